@@ -6,6 +6,10 @@ TIME_LIMIT = 2
 MAX_TIME_LIMIT = 7
 DATE = '04-28'
 NUM_OF_MODELS = 6
+TOPP_WORKERS = 1
+TOPP_GAMES_PER_PAIR = 20
+TOPP_TEMPERATURE = 1.0
+TOPP_CONFIDENCE = 0.95
 
 
 '''
@@ -18,6 +22,11 @@ ACTIVATION = 'relu'
 OPTIMIZER = 'adam'
 LEARNING_RATE = 1e-3
 EPOCHS = 100
+VALUE_HEAD = False
+INFERENCE_MAX_BATCH_SIZE = 64
+INFERENCE_MAX_WAIT_US = 500
+INFERENCE_CACHE_SIZE = 4096
+INFERENCE_BACKEND = 'tensorflow'
 
 '''
 This file contains the configuration for the reinforcement learning algorithm.
@@ -29,3 +38,23 @@ NUMBER_ACTUAL_GAMES = 250
 SIMULATIONS = 2500
 IDENTIFIER = 'model'
 EPSILON_DECAY = 0.95
+SELF_PLAY_WORKERS = 1
+WEIGHT_REFRESH_INTERVAL = 5
+SHARED_INFERENCE = False
+REPLAY_STORE_PATH = None
+AUGMENT_SYMMETRIES = False
+# Only merges the cases of the in-memory replay buffer. With REPLAY_STORE_PATH,
+# training samples the store, which keeps every case.
+DEDUPLICATE_POSITIONS = False
+
+'''
+This file contains the configuration for the Monte Carlo Tree Search.
+'''
+EVALUATION_BATCH_SIZE = 1
+VIRTUAL_LOSS = 1
+LEAF_EVALUATION = 'rollout'
+TREE_POLICY = 'uct'
+C_PUCT = 1.5
+MCTS_WORKERS = 1
+PARALLEL_MODE = 'root'
+TRANSPOSITION_TABLE_SIZE = 0
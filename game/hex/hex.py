@@ -2,10 +2,10 @@
 This module exports the Hex game class. 
 '''
 
-import copy
 import random
+from functools import lru_cache
 import numpy as np
-from disjoint_set import DisjointSet
+from .union_find import UnionFind
 
 
 class State:
@@ -87,6 +87,172 @@ class State:
         '''
         pass
 
+    def copy(self):
+        '''
+        Return a copy of the current state.
+        '''
+        pass
+
+    def snapshot(self):
+        '''
+        Return a snapshot of the current state, which can be restored later.
+        '''
+        pass
+
+    def action_to_index(self, action):
+        '''
+        Return the flat index of an action.
+        '''
+        pass
+
+    def index_to_action(self, index):
+        '''
+        Return the action at a flat index.
+        '''
+        pass
+
+    def restore(self, snapshot):
+        '''
+        Restore the current state from a snapshot.
+        '''
+        pass
+
+    def get_hash(self):
+        '''
+        Return a hash of the position, equal for every move order reaching it.
+        '''
+        pass
+
+    def masked_argmax(self, distribution):
+        '''
+        Return the legal action with the highest value in a distribution over all actions.
+        '''
+        pass
+
+    def masked_sample(self, distribution):
+        '''
+        Return a legal action sampled from a distribution over all actions.
+        '''
+        pass
+
+
+@lru_cache(maxsize=None)
+def board_masks(size: int) -> tuple:
+    '''
+    Precompute the bitboard masks for a board size. The masks are shared by
+    every Hex instance of the same size.
+
+    Parameters
+    ----------
+    size : int
+        The size of the board.
+
+    Returns
+    -------
+    neighbour_masks : tuple of int
+        The neighbour mask of each cell, indexed by x * size + y.
+    edge_masks : tuple of tuple of int
+        The (start, end) edge masks of each player. Player 0 connects the
+        left and right columns, player 1 connects the top and bottom rows.
+    full_mask : int
+        A mask with every cell of the board set.
+    '''
+    neighbour_masks = []
+    for x in range(size):
+        for y in range(size):
+            mask = 0
+            for i, j in adjecent_neighbours(size, x, y):
+                mask |= 1 << (i * size + j)
+            neighbour_masks.append(mask)
+
+    left = right = top = bottom = 0
+    for i in range(size):
+        left |= 1 << (i * size)
+        right |= 1 << (i * size + size - 1)
+        top |= 1 << i
+        bottom |= 1 << ((size - 1) * size + i)
+
+    full_mask = (1 << (size * size)) - 1
+    return tuple(neighbour_masks), ((left, right), (top, bottom)), full_mask
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(size: int) -> tuple:
+    '''
+    Draw the Zobrist keys for a board size. The keys are drawn from a fixed
+    seed, so the hash of a position is the same in every process.
+
+    Parameters
+    ----------
+    size : int
+        The size of the board.
+
+    Returns
+    -------
+    stone_keys : tuple of tuple of int
+        The 64 bit key of a stone of each player on each cell, indexed by
+        player and x * size + y.
+    player_key : int
+        The key toggled when the player to move changes.
+    '''
+    rng = np.random.default_rng(size)
+    keys = rng.integers(0, 2**63, size=(2, size * size + 1), dtype=np.int64)
+    stone_keys = tuple(tuple(int(key) for key in player_keys[:-1]) for player_keys in keys)
+    return stone_keys, int(keys[0, -1])
+
+
+def adjecent_neighbours(size: int, x: int, y: int) -> list:
+    """
+    Return a list of adjecent neighbours of a position on the board.
+
+    Parameters
+    ----------
+    size : int
+        The size of the board.
+    x : int
+        The x coordinate of the position.
+    y : int
+        The y coordinate of the position.
+
+    Returns
+    -------
+    neighbours : list of tuple of int
+        A list of adjecent neighbours.
+    """
+    neighbours = []
+    if x > 0:
+        neighbours.append((x - 1, y))
+    if x > 0 and y < size - 1:
+        neighbours.append((x-1, y+1))
+    if x < size - 1:
+        neighbours.append((x + 1, y))
+    if y > 0:
+        neighbours.append((x, y - 1))
+    if y > 0 and x < size - 1:
+        neighbours.append((x+1, y-1))
+    if y < size - 1:
+        neighbours.append((x, y + 1))
+    return neighbours
+
+
+def iterate_bits(mask: int):
+    '''
+    Yield the index of every set bit in a bitboard, from the lowest to the highest.
+    '''
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def unpack_bits(mask: int, n_cells: int) -> np.ndarray:
+    '''
+    Unpack a bitboard into a flat array of 0 and 1, indexed by x * size + y.
+    '''
+    n_bytes = (n_cells + 7) // 8
+    packed = np.frombuffer(mask.to_bytes(n_bytes, 'little'), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder='little')[:n_cells].astype(int)
+
 
 class Hex:
     """
@@ -97,13 +263,18 @@ class Hex:
     size: int
         The size of the board.
 
-    board: list of list of int
-        The board.
-        Hex board is represented as a to dimensional list. 
-        The values of the list are 0, 1, or -1.
-        0 means the position is empty.
-        1 means the position is occupied by the maximizer.
-        -1 means the position is occupied by the minimizer.
+    stones: list of int
+        One bitboard per player. Bit x * size + y is set when the player
+        occupies position (x, y). Player 0 is the minimizer (-1) and player 1
+        is the maximizer (1).
+
+    legal_mask: int
+        A bitboard with a bit set for every empty position.
+
+    union_find: UnionFind
+        The groups of stones on the board. Besides one element per cell, it has
+        four virtual elements for the board sides: size * size + 2 * player is the
+        start edge of a player and size * size + 2 * player + 1 is the end edge.
 
     player : int
         The player to move next.
@@ -111,22 +282,101 @@ class Hex:
     winner : int or None
         The winner of the game. None if the game is not over. 1 for the maximizer, -1 for the minimizer.
 
+    zobrist : int
+        The Zobrist hash of the position, updated incrementally by every move.
+
+    legal_actions : np.ndarray
+        A boolean array with the legal_mask unpacked, indexed by x * size + y.
+        Updated with the bitboard by every move.
+
     """
 
     def __init__(self, size):
         self.size = size
-        self.board = np.array([[0 for i in range(size)] for j in range(size)])
+        self.stones = [0, 0]
         self.player = 0
         self.winner = None
         self.last_move = None
-        # Intialize legal moves
-        self.legal_moves = {(i, j) for i in range(size) for j in range(size)}
-        # Intialize neighbors of each position
-        self.neighbors = {(i, j): self.get_adjecent_neighbours(i, j)
-                          for i in range(size) for j in range(size)}
-        # Disjoint set to check if there is a path from one side to the other
-        self.disjoint_set_player_0 = DisjointSet()
-        self.disjoint_set_player_1 = DisjointSet()
+        # Masks are computed once per board size and shared between states
+        self.neighbour_masks, self.edge_masks, full_mask = board_masks(size)
+        self.legal_mask = full_mask
+        # Union-find with virtual nodes for the four sides of the board
+        self.union_find = UnionFind(size * size + 4)
+        self.stone_keys, self.player_key = zobrist_keys(size)
+        self.zobrist = 0
+        self.legal_actions = np.ones(size * size, dtype=bool)
+
+    def copy(self) -> 'Hex':
+        '''
+        Return a copy of the current state. Only the bitboards and a few
+        scalars are copied, the precomputed masks are shared.
+
+        Returns
+        -------
+        state : Hex
+            A copy of the current state.
+        '''
+        state = Hex.__new__(Hex)
+        state.size = self.size
+        state.stones = self.stones.copy()
+        state.player = self.player
+        state.winner = self.winner
+        state.last_move = self.last_move
+        state.neighbour_masks = self.neighbour_masks
+        state.edge_masks = self.edge_masks
+        state.legal_mask = self.legal_mask
+        state.union_find = self.union_find.copy()
+        state.stone_keys = self.stone_keys
+        state.player_key = self.player_key
+        state.zobrist = self.zobrist
+        state.legal_actions = self.legal_actions.copy()
+        return state
+
+    def snapshot(self) -> tuple:
+        '''
+        Return a snapshot of the mutable part of the current state. Moves can be
+        made in place afterwards and undone by restoring the snapshot.
+
+        Returns
+        -------
+        snapshot : tuple
+            The snapshot of the current state.
+        '''
+        return (self.stones.copy(), self.legal_mask, self.union_find.copy(),
+                self.player, self.winner, self.last_move, self.zobrist,
+                self.legal_actions.copy())
+
+    def restore(self, snapshot: tuple):
+        '''
+        Restore the current state from a snapshot. The snapshot is left untouched,
+        so it can be restored again.
+
+        Parameters
+        ----------
+        snapshot : tuple
+            A snapshot returned by snapshot().
+        '''
+        (stones, self.legal_mask, union_find, self.player, self.winner,
+         self.last_move, self.zobrist, legal_actions) = snapshot
+        self.stones = stones.copy()
+        self.union_find = union_find.copy()
+        self.legal_actions = legal_actions.copy()
+
+    def __copy__(self) -> 'Hex':
+        return self.copy()
+
+    def __deepcopy__(self, memo) -> 'Hex':
+        return self.copy()
+
+    @property
+    def board(self) -> np.ndarray:
+        '''
+        The board as a two dimensional array. The values are 0, 1, or -1.
+        0 means the position is empty.
+        1 means the position is occupied by the maximizer.
+        -1 means the position is occupied by the minimizer.
+        '''
+        return self.extract_flatten_state().reshape(self.size, self.size)
 
     def get_move(self):
         """
@@ -155,7 +405,10 @@ class Hex:
             The move to check.
 
         """
-        return move in self.legal_moves
+        x, y = move
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            return False
+        return bool(self.legal_mask >> (x * self.size + y) & 1)
 
     def get_winner(self):
         '''
@@ -206,6 +459,7 @@ class Hex:
         Change the player to move.
         '''
         self.player = 1 - self.player
+        self.zobrist ^= self.player_key
 
     def get_last_move(self):
         '''
@@ -235,11 +489,65 @@ class Hex:
         '''
         return self.get_last_move()
 
+    def get_hash(self):
+        '''
+        Return the Zobrist hash of the position. Positions reached by different
+        move orders have the same hash.
+
+        Returns
+        -------
+        zobrist : int
+            The hash of the stones and the player to move.
+        '''
+        return self.zobrist
+
     def get_legal_moves(self):
         """
         Return a list of legal moves. A move is a tuple (x, y) where x and y are the coordinates of the move.
+        The moves are ordered by their position on the flattened board.
         """
-        return self.legal_moves
+        return [divmod(index, self.size) for index in iterate_bits(self.legal_mask)]
+
+    def masked_argmax(self, distribution):
+        '''
+        Return the legal action with the highest probability in a distribution
+        over all the cells of the board.
+
+        Parameters
+        ----------
+        distribution : np.ndarray
+            The probability of each action, indexed by x * size + y.
+
+        Returns
+        -------
+        action : tuple of int
+            The legal action with the highest probability.
+        '''
+        index = np.argmax(np.where(self.legal_actions, distribution, -np.inf))
+        return self.index_to_action(index)
+
+    def masked_sample(self, distribution):
+        '''
+        Return a legal action sampled from a distribution over all the cells of
+        the board, renormalized over the legal actions. A distribution without
+        probability on any legal action is replaced by a uniform one.
+
+        Parameters
+        ----------
+        distribution : np.ndarray
+            The probability of each action, indexed by x * size + y.
+
+        Returns
+        -------
+        action : tuple of int
+            The sampled legal action.
+        '''
+        probabilities = np.where(self.legal_actions, distribution, 0)
+        total = probabilities.sum()
+        if total <= 0:
+            probabilities, total = self.legal_actions.astype(float), self.legal_actions.sum()
+        index = np.random.choice(len(probabilities), p=probabilities / total)
+        return self.index_to_action(index)
 
     def get_legal_actions(self):
         """
@@ -247,23 +555,63 @@ class Hex:
         """
         return self.get_legal_moves()
 
+    def action_to_index(self, action):
+        '''
+        Return the index of an action on the flattened board.
+
+        Parameters
+        ----------
+        action : tuple of int
+            The action.
+
+        Returns
+        -------
+        index : int
+            The flat index x * size + y.
+        '''
+        x, y = action
+        return x * self.size + y
+
+    def index_to_action(self, index):
+        '''
+        Return the action at an index of the flattened board.
+
+        Parameters
+        ----------
+        index : int
+            The flat index x * size + y.
+
+        Returns
+        -------
+        action : tuple of int
+            The action.
+        '''
+        return divmod(int(index), self.size)
+
     def make_move(self, move):
         """
         Make a move on the board, change the player to move, and check if the game is over.
         """
         x, y = move
-        self.board[x][y] = -1 if self.player == 0 else 1
-        self.legal_moves.remove(move)
-        if self.player == 0:
-            self.disjoint_set_player_0.find(move)
-            for neighbour in self.neighbors[x, y]:
-                if self.board[neighbour[0]][neighbour[1]] == -1:
-                    self.disjoint_set_player_0.union(move, neighbour)
-        else:
-            self.disjoint_set_player_1.find(move)
-            for neighbour in self.neighbors[x, y]:
-                if self.board[neighbour[0]][neighbour[1]] == 1:
-                    self.disjoint_set_player_1.union(move, neighbour)
+        index = x * self.size + y
+        bit = 1 << index
+        if not self.legal_mask & bit:
+            raise ValueError(f'Illegal move {move}')
+        self.legal_mask &= ~bit
+        self.legal_actions[index] = False
+        self.stones[self.player] |= bit
+        self.zobrist ^= self.stone_keys[self.player][index]
+
+        own = self.stones[self.player]
+        for neighbour in iterate_bits(self.neighbour_masks[index] & own):
+            self.union_find.union(index, neighbour)
+        start_edge, end_edge = self.edge_masks[self.player]
+        virtual_start = self.size * self.size + 2 * self.player
+        if bit & start_edge:
+            self.union_find.union(index, virtual_start)
+        if bit & end_edge:
+            self.union_find.union(index, virtual_start + 1)
+
         self.set_last_move(move)
         self.check_winner()
         self.change_player()
@@ -280,7 +628,7 @@ class Hex:
         """
         states = []
         for move in self.get_legal_moves():
-            state = copy.deepcopy(self)
+            state = self.copy()
             state.make_move(move)
             states.append(state)
         return states
@@ -289,8 +637,8 @@ class Hex:
         """
         Return a random successor state.
         """
-        move = random.choice(list(self.get_legal_moves()))
-        state = copy.deepcopy(self)
+        move = random.choice(self.get_legal_moves())
+        state = self.copy()
         state.make_move(move)
         return state
 
@@ -298,29 +646,25 @@ class Hex:
         '''
         Return the successor state at index.
         '''
-        move = list(self.get_legal_moves())[index]
-        state = copy.deepcopy(self)
+        move = self.get_legal_moves()[index]
+        state = self.copy()
         state.make_move(move)
         return state
 
     def check_winner(self):
         """
-        Check if the game is over, and set the winner if the game is over.
+        Check if the player who made the last move has connected the two virtual
+        nodes of their sides, and set the winner if the game is over.
 
         Returns
         -------
         winner : int or None
             The winner of the game. None if the game is not over.
         """
-        for i in range(self.size):
-            for j in range(self.size):
-                if self.board[i][0] == -1 and self.board[j][self.size - 1] == -1:
-                    if self.disjoint_set_player_0.connected((i, 0), (j, self.size - 1)):
-                        self.set_winner(-1)
-
-                if self.board[0][i] == 1 and self.board[self.size - 1][j] == 1:
-                    if self.disjoint_set_player_1.connected((0, i), (self.size - 1, j)):
-                        self.set_winner(1)
+        virtual_start = self.size * self.size + 2 * self.player
+        if self.union_find.connected(virtual_start, virtual_start + 1):
+            self.set_winner(-1 if self.player == 0 else 1)
+        return self.winner
 
     def get_adjecent_neighbours(self, x, y):
         """
@@ -338,35 +682,15 @@ class Hex:
         neighbours : list of tuple of int
             A list of adjecent neighbours.
         """
-
-        neighbours = []
-        if x > 0:
-            neighbours.append((x - 1, y))
-        if x > 0 and y < self.size - 1:
-            neighbours.append((x-1, y+1))
-        if x < self.size - 1:
-            neighbours.append((x + 1, y))
-        if y > 0:
-            neighbours.append((x, y - 1))
-        if y > 0 and x < self.size - 1:
-            neighbours.append((x+1, y-1))
-        if y < self.size - 1:
-            neighbours.append((x, y + 1))
-        return neighbours
+        return adjecent_neighbours(self.size, x, y)
 
     def extract_representation(self, training=True):
         '''
         Extract a representation of the current state, to feed it to a neural network.
         '''
-        flat_board = self.board.flatten()
+        flat_board = self.extract_flatten_state()
         player_to_move = np.array([self.player if self.player == 1 else -1])
 
-        # if self.last_move is not None:
-        #     last_move = np.array(
-        #         [self.last_move[0] * self.size + self.last_move[1]])
-        # else:
-        #     last_move = np.array([-1])
-
         board_representation = np.hstack(
             [flat_board, player_to_move])
         if training:
@@ -374,12 +698,17 @@ class Hex:
         return np.expand_dims(board_representation, axis=0)
 
     def extract_flatten_state(self):
-        return self.board.flatten()
+        '''
+        Return the flattened board. The values are 0, 1, or -1.
+        '''
+        n_cells = self.size * self.size
+        return unpack_bits(self.stones[1], n_cells) - unpack_bits(self.stones[0], n_cells)
 
     def draw(self):
         '''
         Draw the current state.
         '''
+        board = self.board
         even_row = True
         l = self.size * 2 - 1
         for i in range(l):
@@ -391,12 +720,12 @@ class Hex:
                 even = True
                 for j in range(l):
                     if even:
-                        if self.board[i // 2][j // 2] == -1:
+                        if board[i // 2][j // 2] == -1:
                             print("X", end="")
-                        elif self.board[i // 2][j // 2] == 1:
+                        elif board[i // 2][j // 2] == 1:
                             print("+", end="")
                         else:
-                            print(self.board[i // 2][j // 2], end="")
+                            print(board[i // 2][j // 2], end="")
                     else:
                         print(" - ", end="")
                     even = not even
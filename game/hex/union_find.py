@@ -0,0 +1,92 @@
+'''
+This module exports an array-backed union-find used for win detection in Hex.
+'''
+
+
+class UnionFind:
+    '''
+    Union-find over the integers 0..n-1, with union by rank and path halving.
+    The parents and ranks are stored in plain lists, so a copy is two list copies.
+
+    Parameters
+    ----------
+    n : int
+        The number of elements.
+    '''
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.rank = [0] * n
+
+    def copy(self) -> 'UnionFind':
+        '''
+        Return a copy of the union-find.
+
+        Returns
+        -------
+        union_find : UnionFind
+            A copy of the union-find.
+        '''
+        union_find = UnionFind.__new__(UnionFind)
+        union_find.parent = self.parent.copy()
+        union_find.rank = self.rank.copy()
+        return union_find
+
+    def find(self, element: int) -> int:
+        '''
+        Find the representative of the set containing an element.
+
+        Parameters
+        ----------
+        element : int
+            The element.
+
+        Returns
+        -------
+        root : int
+            The representative of the set.
+        '''
+        parent = self.parent
+        while parent[element] != element:
+            parent[element] = parent[parent[element]]
+            element = parent[element]
+        return element
+
+    def union(self, a: int, b: int):
+        '''
+        Merge the sets containing a and b.
+
+        Parameters
+        ----------
+        a : int
+            The first element.
+        b : int
+            The second element.
+        '''
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return
+        if self.rank[root_a] < self.rank[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        if self.rank[root_a] == self.rank[root_b]:
+            self.rank[root_a] += 1
+
+    def connected(self, a: int, b: int) -> bool:
+        '''
+        Check if a and b are in the same set.
+
+        Parameters
+        ----------
+        a : int
+            The first element.
+        b : int
+            The second element.
+
+        Returns
+        -------
+        connected : bool
+            True if a and b are in the same set, False otherwise.
+        '''
+        return self.find(a) == self.find(b)
@@ -3,15 +3,16 @@ This is an example of how to use the neural network actors
 '''
 import argparse
 
-import numpy as np
 from game import Hex
-from mcts import Node
-from neural_network import load_models
-from neural_network.anet import ANet
+from mcts import MCTS, Node
+from neural_network import CheckpointRegistry, NumpyNet, load_networks, BACKENDS
 from reinforcement_learning import Actor
-from config import IDENTIFIER, BOARD_SIZE, NUM_OF_MODELS
+from config import IDENTIFIER, BOARD_SIZE, NUM_OF_MODELS, MCTS_WORKERS, PARALLEL_MODE, TOPP_WORKERS, INFERENCE_BACKEND
 from topp import TOPP
 
+# ANet and load_models are imported where they are used, since they load TensorFlow,
+# which the NumPy backend and the search without a neural network do not need
+
 
 def main(args):
     '''
@@ -22,48 +23,63 @@ def main(args):
     args : argparse.Namespace
         The parsed arguments
     '''
+    registry = CheckpointRegistry(IDENTIFIER, BOARD_SIZE)
+    # The last of the first NUM_OF_MODELS checkpoints, like load_models
+    last_checkpoint = min(len(registry), NUM_OF_MODELS) - 1
+
     if args.load_models:
-        nets = load_models(IDENTIFIER, M=(
-            NUM_OF_MODELS), board_size=BOARD_SIZE)
-        anet = ANet(nets[-1])
+        if last_checkpoint >= 0:
+            anet = registry.load_anet(last_checkpoint)
+        else:
+            from neural_network.anet import ANet, load_models
+            nets = load_models(IDENTIFIER, M=(
+                NUM_OF_MODELS), board_size=BOARD_SIZE)
+            if not nets:
+                raise FileNotFoundError(
+                    f'No model of {IDENTIFIER} found in {registry.directory} to continue training')
+            anet = ANet(model=nets[-1])
         actor = Actor(anet=anet)
-        actor.run(use_neural_network=True)
+        actor.run(use_neural_network=True, workers=args.workers)
 
     elif args.tournament:
-        models = load_models(IDENTIFIER, M=(
-            NUM_OF_MODELS), board_size=BOARD_SIZE)
-        agents = [model for model in models]
-        tournament = TOPP(agents)
+        agents = load_networks(args.backend, registry, NUM_OF_MODELS)
+        tournament = TOPP(agents, workers=args.workers or TOPP_WORKERS)
         tournament.tournament()
-        results = tournament.results
-        for i, result in enumerate(results):
-            print(result)
-            if (i + 1) % (NUM_OF_MODELS - 1) == 0:
-                print('\n')
+        print(tournament.summary())
 
     elif args.train:
         actor = Actor(anet=None)
-        actor.run(use_neural_network=False)
+        actor.run(use_neural_network=False, workers=args.workers)
 
     elif args.play:
-        nets = load_models(IDENTIFIER, M=(
-            NUM_OF_MODELS), board_size=BOARD_SIZE)
-        anet = ANet(model=nets[-1]) if nets else ANet()
+        # Only the played checkpoint is loaded
+        nets = load_networks(args.backend, registry, NUM_OF_MODELS, last_only=True)
+        if nets:
+            anet = nets[0]
+        elif args.backend == 'numpy':
+            anet = NumpyNet.initialize()
+        else:
+            from neural_network.anet import ANet
+            anet = ANet()
         game = Hex(BOARD_SIZE)
         game.draw()
         root_node = Node(game)
+        mcts = None
+        if args.simulations:
+            mcts = MCTS(Node(game.copy()), args.simulations, 0, anet,
+                        workers=args.workers or MCTS_WORKERS, parallel=args.parallel)
 
         while not game.is_terminal():
-            if game.player == 1:
+            if game.player == 1 and mcts:
+                mcts.root_node = Node(game.copy())
+                best_child, _ = mcts(0)
+                action = best_child.state.get_previous_action()
+                print(f'\nAI move: {action}')
+            elif game.player == 1:
                 state_repesentation = root_node.state.extract_representation(
                     False)
                 target_dist = anet.predict(state_repesentation)
-                flatten_state = root_node.state.extract_flatten_state()
-                legal_action = [1 if flatten_state[i] ==
-                                0 else 0 for i in range(len(flatten_state))]
-                target_dist = np.array(target_dist) * np.array(legal_action)
-                i = np.argmax(target_dist)
-                action = i // BOARD_SIZE, i % BOARD_SIZE
+                action = root_node.state.masked_argmax(target_dist[0])
                 print(f'\nAI move: {action}')
             else:
                 action = game.get_move()
@@ -71,6 +87,8 @@ def main(args):
             game.make_move(action)
             game.draw()
             root_node = Node(game, parent=root_node)
+        if mcts:
+            mcts.close()
 
     else:
         print("Please specify an argument")
@@ -100,6 +118,18 @@ def parse_args():
     parser.add_argument("--play", action="store_true",
                         help="Play against the neural network model")
 
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of self-play processes used for training, of MCTS workers used for playing, or of tournament processes")
+
+    parser.add_argument("--simulations", type=int, default=None,
+                        help="Let the AI search this many MCTS simulations per move when playing")
+
+    parser.add_argument("--parallel", choices=["root", "tree"], default=PARALLEL_MODE,
+                        help="Parallel MCTS mode used with more than one worker when playing")
+
+    parser.add_argument("--backend", choices=BACKENDS, default=INFERENCE_BACKEND,
+                        help="Run the neural network with TensorFlow or with NumPy when playing or in a tournament")
+
     return parser.parse_args()
 
 
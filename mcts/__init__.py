@@ -3,3 +3,4 @@ This module exports the monte carlo tree search algorithm.
 '''
 from .search import MCTS
 from .node import Node
+from .tree import Tree
@@ -4,22 +4,61 @@ This module contains the Node class, which is used to represent a node in the se
 from config import BOARD_SIZE
 from game import State
 import numpy as np
-import random
+from .tree import Tree
 
 
 class Node:
     '''
-    The Node class is used to represent a node in the search tree.
+    The Node class is used to represent a node in the search tree. The statistics
+    of the node live in the arrays of a Tree, and a Node is a light handle to
+    one id in that tree.
+
+    Parameters
+    ----------
+    state : State
+        The state of the node. A new tree is created with the node as root,
+        unless a parent is given.
+    parent : Node
+        The parent node. The node is added as a child of the parent.
+    tree : Tree
+        The tree of an existing node. Used together with index to create a
+        handle to a node that is already in the tree.
+    index : int
+        The id of an existing node in the tree.
     '''
 
-    def __init__(self, state: State, parent=None):
-        self.state = state
-        self.parent: 'Node' = parent
-        #intialize children as empty numpy array with the same function as self.children = []:  list['Node'] = []
-        self.children: list['Node'] = []
-        self.visits: int = 0
-        self.value: float = 0
-        self.last_child = None
+    def __init__(self, state: State = None, parent: 'Node' = None, tree: Tree = None, index: int = None):
+        if tree is not None:
+            self.tree: Tree = tree
+            self.index: int = index
+        elif parent is not None:
+            self.tree = parent.tree
+            self.index = parent.tree.add_children(parent.index, [state])[0]
+        else:
+            self.tree = Tree()
+            self.index = self.tree.add_root(state)
+
+    @property
+    def state(self) -> State:
+        return self.tree.get_state(self.index)
+
+    @property
+    def parent(self) -> 'Node':
+        parent = self.tree.parent[self.index]
+        return None if parent == -1 else Node(tree=self.tree, index=int(parent))
+
+    @property
+    def children(self) -> list['Node']:
+        children = self.tree.children(self.index)
+        return [Node(tree=self.tree, index=child) for child in range(children.start, children.stop)]
+
+    @property
+    def visits(self) -> int:
+        return int(self.tree.visits[self.index])
+
+    @property
+    def value(self) -> float:
+        return float(self.tree.value[self.index])
 
     def add_child(self, child_state) -> 'Node':
         '''
@@ -35,9 +74,7 @@ class Node:
         child_node : Node
             The child node.
         '''
-        child_node = Node(child_state, self)
-        self.children.append(child_node)
-        return child_node
+        return Node(child_state, self)
 
     def add_children(self, child_states):
         '''
@@ -48,8 +85,7 @@ class Node:
         child_states : list of State
             The states of the child nodes.
         '''
-        for child_state in child_states:
-            self.add_child(child_state)
+        self.tree.add_children(self.index, child_states)
 
     def update(self, value: int):
         '''
@@ -60,8 +96,8 @@ class Node:
         value : int
             The value of the current node.
         '''
-        self.visits += 1
-        self.value += value
+        self.tree.visits[self.index] += 1
+        self.tree.value[self.index] += value
 
     def is_leaf(self) -> bool:
         '''
@@ -72,7 +108,7 @@ class Node:
         is_leaf : bool
             True if the current node is a leaf node, False otherwise.
         '''
-        return len(self.children) == 0
+        return self.tree.num_children[self.index] == 0
 
     def is_root(self) -> bool:
         '''
@@ -83,7 +119,7 @@ class Node:
         is_root : bool
             True if the current node is the root node, False otherwise.
         '''
-        return self.parent is None
+        return self.tree.parent[self.index] == -1
 
     def is_terminal(self) -> bool:
         '''
@@ -107,9 +143,11 @@ class Node:
         '''
         return self.state.get_value()
 
-    def expand(self, next_states, illegal_state=None):
+    def expand(self, next_states=None, illegal_state=None):
         '''
-        Expand the current node by adding its children.
+        Expand the current node by adding its children. Without next_states,
+        one child is added per legal action and the state of a child is only
+        created when it is first requested.
 
         Parameters
         ----------
@@ -118,9 +156,13 @@ class Node:
         illegal_state : float
             The state of the illegal child node.
         '''
-        if illegal_state is not None:
+        if next_states is None:
+            state = self.state
+            self.tree.add_actions(self.index, [
+                state.action_to_index(action) for action in state.get_legal_actions()])
+        elif illegal_state is not None:
             legal_child_states = [
-                state != illegal_state for state in next_states]
+                state for state in next_states if state != illegal_state]
             self.add_children(legal_child_states)
         else:
             self.add_children(next_states)
@@ -134,16 +176,7 @@ class Node:
         distribution: list
             The visit count distribution of the children of the root node.
         '''
-        visit_counts = [0] * BOARD_SIZE**2
-
-        for child in self.children:
-            prev_action = child.state.get_previous_action()
-            index = prev_action[0] * BOARD_SIZE + prev_action[1]
-            visit_counts[index] = child.visits
-        total_visit_count = sum(visit_counts)
-        distribution = np.array(
-            [count / total_visit_count for count in visit_counts])
-        return distribution
+        return self.tree.visit_count_distribution(self.index, BOARD_SIZE**2)
 
     def get_best_child(self) -> 'Node':
         '''
@@ -153,18 +186,15 @@ class Node:
 
         -------
         best_child : Node
-            The best child node. If player is 1, then the best child is a maximum, otherwise it is a minimum.
+            The best child node, the child with the most visits. Ties are broken randomly.
         '''
-        # return max value of random of one of the largest values
-        total_visits = sum(child.visits for child in self.children)
-        max_ratio = max(child.visits / total_visits for child in self.children)
-        best_children = [child for child in self.children if child.visits / total_visits == max_ratio]
-        return random.choice(best_children)
+        return Node(tree=self.tree, index=self.tree.best_child(self.index))
 
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Node) and self.tree is other.tree and self.index == other.index
 
-        # return max(self.children, key=lambda node: node.visits / sum(child.visits for child in self.children))
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
 
     def __str__(self) -> str:
         return f'Node({self.state}, {self.visits}, {self.value})'
-
-    
\ No newline at end of file
@@ -1,13 +1,11 @@
 '''
-The policy module contains the TreePolicy and DefaultPolicy classes.
+The policy module contains the TreePolicy, PUCTPolicy, DefaultPolicy, TargetPolicy and ValuePolicy classes.
 '''
 import random
 import numpy as np
 
-from neural_network.anet import ANet
+from neural_network.inference_cache import CachedInference
 from .node import Node
-from time import time
-import copy
 
 
 class TreePolicy:
@@ -29,11 +27,8 @@ class TreePolicy:
         max_child_node: Node
             The child node with the highest value.
         '''
-        max_value = max(self.calculate_value(child) for child in self.node.children)
-        max_child_nodes = [child for child in self.node.children if self.calculate_value(child) == max_value]
-        return random.choice(max_child_nodes)
-
-        # return max(self.node.children, key=self.calculate_value)
+        values = self.calculate_values()
+        return self.choose(np.flatnonzero(values == values.max()))
 
     def minimize(self) -> Node:
         '''
@@ -44,11 +39,47 @@ class TreePolicy:
         min_child_node: Node
             The child node with the lowest value.
         '''
-        min_value = min(self.calculate_value(child) for child in self.node.children)
-        min_child_nodes = [child for child in self.node.children if self.calculate_value(child) == min_value]
-        return random.choice(min_child_nodes)
+        values = self.calculate_values()
+        return self.choose(np.flatnonzero(values == values.min()))
+
+    def choose(self, candidates: np.ndarray) -> Node:
+        '''
+        Randomly choose one of the candidate children.
+
+        Parameters
+        ----------
+        candidates: np.ndarray
+            The positions of the candidates among the children of the node.
+
+        Returns
+        -------
+        child_node: Node
+            The chosen child node.
+        '''
+        children = self.node.tree.children(self.node.index)
+        return Node(tree=self.node.tree, index=children.start + int(random.choice(candidates)))
 
-        # return min(self.node.children, key=self.calculate_value)
+    def calculate_values(self) -> np.ndarray:
+        '''
+        Calculate the values of all children of the node in one pass over the
+        arrays of the tree.
+
+        Returns
+        -------
+        values: np.ndarray
+            The value of each child node.
+        '''
+        epsilon = 1
+
+        tree = self.node.tree
+        children = tree.children(self.node.index)
+        visits = tree.visits[children]
+        q_values = np.divide(tree.value[children], visits,
+                             out=np.zeros(len(visits)), where=visits > 0)
+        exploration_bonus = self.c_punt * \
+            np.sqrt(np.log(tree.visits[self.node.index] + epsilon) /
+                    (visits + epsilon))
+        return q_values + exploration_bonus if tree.player[self.node.index] == 1 else q_values - exploration_bonus
 
     def calculate_value(self, child_node: Node) -> float:
         '''
@@ -64,17 +95,8 @@ class TreePolicy:
         value: float
             The value of the child node.
         '''
-
-        epsilon = 1
-
-        if child_node.visits == 0:
-            q_value = 0
-        else:
-            q_value = child_node.value / child_node.visits
-        exploration_bonus = self.c_punt * \
-            np.sqrt(np.log(self.node.visits + epsilon) /
-                    (child_node.visits + epsilon))
-        return q_value + exploration_bonus if self.node.state.player == 1 else q_value - exploration_bonus
+        children = self.node.tree.children(self.node.index)
+        return self.calculate_values()[child_node.index - children.start]
 
     def __call__(self) -> Node:
         '''
@@ -91,13 +113,39 @@ class TreePolicy:
         next_node: Node
             The next node.
         '''
-        if self.node.state.player == 1:
+        if self.node.tree.player[self.node.index] == 1:
             next_node = self.maximize()
         else:
             next_node = self.minimize()
         return next_node
 
 
+class PUCTPolicy(TreePolicy):
+    '''
+    The PUCTPolicy class is a tree policy where the exploration term of each
+    child is weighted by its prior probability from the policy network. The
+    priors are cached in the tree when the node is expanded.
+    '''
+
+    def calculate_values(self) -> np.ndarray:
+        '''
+        Calculate the PUCT values of all children of the node.
+
+        Returns
+        -------
+        values: np.ndarray
+            The value of each child node.
+        '''
+        tree = self.node.tree
+        children = tree.children(self.node.index)
+        visits = tree.visits[children]
+        q_values = np.divide(tree.value[children], visits,
+                             out=np.zeros(len(visits)), where=visits > 0)
+        exploration_bonus = self.c_punt * tree.prior[children] * \
+            np.sqrt(tree.visits[self.node.index]) / (1 + visits)
+        return q_values + exploration_bonus if tree.player[self.node.index] == 1 else q_values - exploration_bonus
+
+
 class DefaultPolicy:
     '''
     The DefaultPolicy class is used to represent the default policy of the
@@ -106,26 +154,45 @@ class DefaultPolicy:
     used, since we are using on-policy Monte Carlo Tree Search.
     '''
 
-    def __call__(self, curr_node: Node) -> Node:
+    def __call__(self, curr_node: Node) -> int:
         '''
-        Using the target policy to evaluate the leaf node. Randomly selecting child
-        nodes until the game is finished.
+        Using the target policy to evaluate the leaf node. Randomly selecting moves
+        until the game is finished. The rollout is played in place on the state of
+        the leaf node, which is restored afterwards, so no nodes are added to the tree.
 
         Parameters
         ----------
         node: Node
             The leaf node.
+
+        Returns
+        -------
+        value: int
+            The value of the final state.
         '''
+        state = curr_node.state
+        snapshot = state.snapshot()
+        value = self.rollout(state)
+        state.restore(snapshot)
+        return value
 
-        while not curr_node.is_terminal():
+    def rollout(self, state) -> int:
+        '''
+        Play random moves on the state, in place, until the game is finished.
 
-            next_state = curr_node.state.expand_random()
-            curr_node.add_child(next_state)
-            for child in curr_node.children:
-                if child.state == next_state:
-                    curr_node = child
-        return curr_node
+        Parameters
+        ----------
+        state: State
+            The state to play from. It is left in the final state.
 
+        Returns
+        -------
+        value: int
+            The value of the final state.
+        '''
+        while not state.is_terminal():
+            state.make_move(random.choice(state.get_legal_moves()))
+        return state.get_value()
 
 
 class TargetPolicy:
@@ -136,42 +203,163 @@ class TargetPolicy:
     used, since we are using on-policy Monte Carlo Tree Search.
     '''
 
-    def __init__(self, neural_network: ANet):
+    def __init__(self, neural_network: CachedInference):
         self.neural_network = neural_network
 
-    def __call__(self, leaf_node: Node, epsilon: float) -> Node:
+    def __call__(self, leaf_node: Node, epsilon: float) -> int:
         '''
-        Using the target policy to evaluate the leaf node. Randomly selecting child
-        nodes until the game is finished.
+        Using the target policy to evaluate the leaf node. Selecting moves randomly
+        with probability epsilon, and with the neural network otherwise, until the
+        game is finished. The rollout is played in place on the state of the leaf
+        node, which is restored afterwards, so no nodes are added to the tree.
 
         Parameters
         ----------
         node: Node
             The leaf node.
+
+        Returns
+        -------
+        value: int
+            The value of the final state.
         '''
-        while not leaf_node.is_terminal():
-            if (random.random() < epsilon):
+        state = leaf_node.state
+        snapshot = state.snapshot()
+        value = self.rollout(state, epsilon)
+        state.restore(snapshot)
+        return value
+
+    def rollout(self, state, epsilon: float) -> int:
+        '''
+        Play moves on the state, in place, until the game is finished. Moves are
+        random with probability epsilon, and chosen by the neural network otherwise.
+
+        Parameters
+        ----------
+        state: State
+            The state to play from. It is left in the final state.
+        epsilon: float
+            The probability of selecting a random move.
 
-                next_state = leaf_node.state.expand_random()
-                leaf_node.add_child(next_state)
-                for child in leaf_node.children:
-                    if child.state == next_state:
-                        leaf_node = child
+        Returns
+        -------
+        value: int
+            The value of the final state.
+        '''
+        while not state.is_terminal():
+            if (random.random() < epsilon):
+                move = random.choice(state.get_legal_moves())
 
             else:
-                state_representation = leaf_node.state.extract_representation(False)
-                target_dist = self.neural_network.model(state_representation)
-                flatten_state = leaf_node.state.extract_flatten_state()
-                legal_action = [1 if flatten_state[i] ==
-                                0 else 0 for i in range(len(flatten_state))]
-
-                target_dist = np.array(target_dist) * np.array(legal_action)
-                target_dist = target_dist[target_dist != 0]
-                i = np.argmax(target_dist)
-
-                next_state = leaf_node.state.expand_index(i)
-                leaf_node.add_child(next_state)
-                for child in leaf_node.children:
-                    if child.state == next_state:
-                        leaf_node = child
-        return leaf_node
+                state_representation = state.extract_representation(False)
+                target_dist = self.neural_network.predict(state_representation)
+                move = state.masked_argmax(target_dist[0])
+
+            state.make_move(move)
+        return state.get_value()
+
+    def evaluate_batch(self, leaf_nodes: list[Node], epsilon: float) -> list[int]:
+        '''
+        Evaluate several leaf nodes with rollouts played in lockstep. At every ply
+        the positions of all unfinished rollouts that use the neural network are
+        evaluated with a single batched prediction. Each rollout is played on a
+        copy of the state of its leaf node.
+
+        Parameters
+        ----------
+        leaf_nodes: list of Node
+            The leaf nodes.
+        epsilon: float
+            The probability of selecting a random move.
+
+        Returns
+        -------
+        values: list of int
+            The value of the final state of each rollout.
+        '''
+        states = [leaf_node.state.copy() for leaf_node in leaf_nodes]
+        live_states = [state for state in states if not state.is_terminal()]
+        while live_states:
+            network_states = []
+            for state in live_states:
+                if random.random() < epsilon:
+                    state.make_move(random.choice(state.get_legal_moves()))
+                else:
+                    network_states.append(state)
+
+            if network_states:
+                state_representations = np.stack(
+                    [state.extract_representation() for state in network_states])
+                target_dists = self.neural_network.predict(state_representations)
+                for state, target_dist in zip(network_states, target_dists):
+                    state.make_move(state.masked_argmax(target_dist))
+
+            live_states = [state for state in live_states if not state.is_terminal()]
+        return [state.get_value() for state in states]
+
+
+class ValuePolicy:
+    '''
+    The ValuePolicy class is used to evaluate leaf nodes with the value head of
+    the neural network, instead of playing a rollout to the end of the game.
+
+    Parameters
+    ----------
+    neural_network: CachedInference
+        The neural network with a value head.
+    store_policies: bool
+        Whether to keep the predicted policies as priors, when PUCT is used.
+    '''
+
+    def __init__(self, neural_network: CachedInference, store_policies: bool = False):
+        self.neural_network = neural_network
+        self.store_policies = store_policies
+
+    def __call__(self, leaf_node: Node) -> float:
+        '''
+        Evaluate the leaf node with a single prediction of the value head.
+        Terminal nodes are evaluated with the winner of the game.
+
+        Parameters
+        ----------
+        leaf_node: Node
+            The leaf node.
+
+        Returns
+        -------
+        value: float
+            The value of the leaf node.
+        '''
+        return self.evaluate_batch([leaf_node])[0]
+
+    def evaluate_batch(self, leaf_nodes: list[Node]) -> list[float]:
+        '''
+        Evaluate several leaf nodes with one batched prediction of the value head.
+        With store_policies, the predicted policies of the leaves that are not
+        expanded yet are stored in the tree, to be used as priors when the leaves
+        are expanded.
+
+        Parameters
+        ----------
+        leaf_nodes: list of Node
+            The leaf nodes.
+
+        Returns
+        -------
+        values: list of float
+            The value of each leaf node.
+        '''
+        states = [leaf_node.state for leaf_node in leaf_nodes]
+        values = [state.get_value() for state in states]
+        pending = [i for i, state in enumerate(states) if not state.is_terminal()]
+        if pending:
+            state_representations = np.stack(
+                [states[i].extract_representation() for i in pending])
+            policies, predicted_values = self.neural_network.evaluate(state_representations)
+            for i, policy, value in zip(pending, policies, predicted_values):
+                values[i] = float(value)
+                # Kept to set the priors of the children when the leaf is expanded.
+                # A leaf already expanded by another selection has its priors set.
+                if self.store_policies and leaf_nodes[i].is_leaf():
+                    leaf_nodes[i].tree.policies[leaf_nodes[i].index] = policy
+        return values
@@ -2,13 +2,85 @@
 The search module contains the MCTS class, which is used to represent
 the Monte Carlo Tree Search algorithm.
 '''
+import math
+import multiprocessing as mp
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from neural_network.anet import ANet
+from config import EVALUATION_BATCH_SIZE, VIRTUAL_LOSS, LEAF_EVALUATION, TREE_POLICY, C_PUCT, MCTS_WORKERS, PARALLEL_MODE, \
+    TRANSPOSITION_TABLE_SIZE
+from neural_network.inference_cache import CachedInference
+from neural_network.numpy_net import NumpyNet
 from .node import Node
-from .policy import TargetPolicy, TreePolicy, DefaultPolicy
+from .policy import TargetPolicy, TreePolicy, PUCTPolicy, DefaultPolicy, ValuePolicy
+from .transposition import TranspositionTable
 import random
 
+MAX_TIME_LIMIT = 10
+
+# The neural network of a root parallelization worker process
+worker_network: CachedInference = None
+
+
+def init_root_parallel_worker(weights: list, value_head: bool, network: NumpyNet = None):
+    '''
+    Build the neural network of a root parallelization worker process.
+
+    Parameters
+    ----------
+    weights: list
+        The weights of the neural network, or None to search without it.
+    value_head: bool
+        Whether the neural network has a value head.
+    network: NumpyNet
+        A NumPy neural network used as it is instead of building one.
+    '''
+    global worker_network
+    if network is not None:
+        worker_network = network
+    elif weights is not None:
+        # Imported here, so workers without a TensorFlow network do not load it
+        from neural_network.anet import ANet
+        worker_network = ANet(value_head=value_head)
+        worker_network.set_weights(weights)
+
+
+def root_parallel_worker(state, n_simulations: int, time_limit: int, epsilon: float, options: dict) -> tuple:
+    '''
+    Run an independent search from the state in a root parallelization worker process.
+
+    Parameters
+    ----------
+    state: State
+        The state of the root node.
+    n_simulations: int
+        The number of simulations.
+    time_limit: int
+        The time limit of the search.
+    epsilon: float
+        The probability of selecting a random move in the rollouts.
+    options: dict
+        The other arguments of the MCTS.
+
+    Returns
+    -------
+    actions: np.ndarray
+        The actions of the children of the root node.
+    visits: np.ndarray
+        The visit counts of the children.
+    values: np.ndarray
+        The value sums of the children.
+    simulations: int
+        The number of simulations performed.
+    '''
+    mcts = MCTS(Node(state), n_simulations, time_limit, worker_network, **options)
+    simulations = mcts.simulate(epsilon)
+    tree = mcts.root_node.tree
+    children = tree.children(mcts.root_node.index)
+    return tree.action[children], tree.visits[children], tree.value[children], simulations
+
+
 class MCTS:
     '''
     The MCTS class is used to represent the Monte Carlo Tree Search algorithm.
@@ -19,8 +91,33 @@ class MCTS:
         The root node of the search tree.
     n_simulations : int
         The number of simulations.
-    neural_network : ANet
-        The neural network.
+    neural_network : CachedInference
+        The neural network, ANet or any other inference backend.
+    batch_size : int
+        The number of leaves evaluated together by the neural network. With 1,
+        every simulation evaluates its own leaf.
+    virtual_loss : int
+        The virtual loss added to the path of a leaf while it waits for evaluation.
+    evaluation : str
+        How leaves are evaluated with the neural network. 'rollout' plays the game
+        to the end with the target policy, 'value' uses the value head of the network.
+    tree_policy : str
+        The tree policy. 'uct' uses UCB1, 'puct' weights the exploration of each
+        child by the prior from the neural network. Without a neural network UCB1 is used.
+    c_puct : float
+        The exploration constant of the PUCT tree policy.
+    workers : int
+        The number of parallel workers. With one worker the search is sequential.
+    parallel : str
+        How the workers search. 'root' runs independent trees in a process pool
+        and merges their root visit counts, 'tree' shares one tree between threads,
+        using virtual loss and a lock around the tree statistics.
+    transposition_table : TranspositionTable
+        The statistics shared by the nodes of the same position, reached by
+        different move orders. An unvisited leaf whose position was already
+        evaluated gets the mean value of the position instead of a new
+        evaluation, and expanded nodes reuse the policy predicted for their
+        position. None when transposition_table_size is 0.
     '''
 
     def __init__(
@@ -28,40 +125,131 @@ class MCTS:
             root_node: Node,
             n_simulations: int,
             time_limit: int,
-            neural_network: ANet = None,
+            neural_network: CachedInference = None,
+            batch_size: int = EVALUATION_BATCH_SIZE,
+            virtual_loss: int = VIRTUAL_LOSS,
+            evaluation: str = LEAF_EVALUATION,
+            tree_policy: str = TREE_POLICY,
+            c_puct: float = C_PUCT,
+            workers: int = MCTS_WORKERS,
+            parallel: str = PARALLEL_MODE,
+            transposition_table_size: int = TRANSPOSITION_TABLE_SIZE,
 
     ):
         self.root_node: Node = root_node
         self.n_simulations: int = n_simulations
         self.time_limit: int = time_limit
         self.neural_network = neural_network
-
+        self.batch_size: int = batch_size
+        self.virtual_loss: int = virtual_loss
+        if evaluation not in ('rollout', 'value'):
+            raise ValueError(f'Invalid leaf evaluation {evaluation}')
+        if evaluation == 'value' and neural_network is not None and not neural_network.value_head:
+            raise ValueError('The value leaf evaluation needs a neural network with a value head')
+        self.evaluation: str = evaluation
+        if tree_policy not in ('uct', 'puct'):
+            raise ValueError(f'Invalid tree policy {tree_policy}')
+        self.use_priors: bool = tree_policy == 'puct' and neural_network is not None
+        self.c_puct: float = c_puct
+        if parallel not in ('root', 'tree'):
+            raise ValueError(f'Invalid parallel mode {parallel}')
+        self.workers: int = workers
+        self.parallel: str = parallel
+        self.executor: ProcessPoolExecutor = None
+        self.transposition_table: TranspositionTable = None
+        if transposition_table_size > 0:
+            self.transposition_table = TranspositionTable(transposition_table_size)
 
     def search(self) -> Node:
         '''
-        Performing tree search with the tree policy.
+        Performing tree search with the tree policy. The tree policy is applied
+        from the root until a node without children is reached. A terminal or
+        unvisited node is returned as the leaf. Otherwise the node is expanded one
+        level and the tree policy picks one of the new children as the leaf. Only
+        the state of the picked child is created.
 
         Returns
         -------
-        curr_root_node: Node
-            The root node of the search tree.
+        leaf_node: Node
+            The leaf node to evaluate.
+        '''
+        curr_node: Node = self.root_node
+
+        while not curr_node.is_leaf():
+            curr_node = self.tree_policy(curr_node)
+
+        # A node is evaluated on its first visit and expanded on the next one
+        if curr_node.is_terminal() or (curr_node.visits == 0 and not curr_node.is_root()):
+            return curr_node
+
+        curr_node.expand()
+        if self.use_priors:
+            self.expand_priors(curr_node)
+        return self.tree_policy(curr_node)
+
+    def tree_policy(self, node: Node) -> Node:
+        '''
+        Select a child of the node with the tree policy.
+
+        Parameters
+        ----------
+        node: Node
+            The current node.
+
+        Returns
+        -------
+        next_node: Node
+            The selected child node.
+        '''
+        if self.use_priors:
+            return PUCTPolicy(node, self.c_puct)()
+        return TreePolicy(node)()
+
+    def expand_priors(self, node: Node):
         '''
+        Set the priors of the children of an expanded node from the policy network.
+        A policy predicted when the node or a transposition of it was evaluated is
+        reused, otherwise the network is called once for the node.
 
-        curr_root_node: Node = self.root_node
+        Parameters
+        ----------
+        node: Node
+            The expanded node.
+        '''
+        policy = node.tree.policies.pop(node.index, None)
+        if policy is None and self.transposition_table is not None:
+            policy = self.transposition_table.policy(node.state.get_hash())
+        if policy is None:
+            policy = self.neural_network.predict(
+                node.state.extract_representation(False))[0]
+        if self.transposition_table is not None:
+            self.transposition_table.store_policy(node.state.get_hash(), policy)
+        node.tree.set_priors(node.index, policy)
 
-        if curr_root_node.children == []:
-            legal_moves = curr_root_node.state.expand()
-            curr_root_node.expand(legal_moves)
+    def transposition_value(self, leaf_node: Node) -> float:
+        '''
+        Return the mean value of the position of an unvisited leaf node from the
+        transposition table, if the position was reached by another move order.
 
-        tree_policy = TreePolicy(self.root_node)
-        curr_root_node = tree_policy()
+        Parameters
+        ----------
+        leaf_node: Node
+            The leaf node.
 
-        return curr_root_node
+        Returns
+        -------
+        value: float
+            The mean value of the position, or None if it must be evaluated.
+        '''
+        if self.transposition_table is None or leaf_node.visits > 0 or leaf_node.is_terminal():
+            return None
+        return self.transposition_table.value(leaf_node.state.get_hash())
 
     def leaf_evaluation(self, leaf_node: Node, epsilon: float) -> int:
         '''
         Estimating the value of a leaf node in the tree by doing a rollout simulation 
-        using the default policy from the leaf node’s state to a final state.
+        using the default policy from the leaf node’s state to a final state, or
+        with the value head of the neural network.
 
         Parameters
         ----------
@@ -73,19 +261,82 @@ class MCTS:
         evalution: int
             The value of the leaf node.
         '''
-        if self.neural_network:
+        evalution = self.transposition_value(leaf_node)
+        if evalution is not None:
+            return evalution
+        if self.neural_network and self.evaluation == 'value':
+            value_policy = ValuePolicy(self.neural_network, self.use_priors)
+            evalution = value_policy(leaf_node)
+        elif self.neural_network:
             target_policy = TargetPolicy(self.neural_network)
-            evalution = target_policy(
-                leaf_node, epsilon).state.get_value()
+            evalution = target_policy(leaf_node, epsilon)
         else:
             default_policy = DefaultPolicy()
-            evalution = default_policy(leaf_node).state.get_value()
+            evalution = default_policy(leaf_node)
         return evalution
 
+    def batch_leaf_evaluation(self, epsilon: float) -> int:
+        '''
+        Selecting batch_size leaf nodes, evaluating them together with the neural
+        network and backpropagating all evaluations. A virtual loss is added to the
+        path of every selected leaf, so the following selections spread over
+        different leaves.
+
+        Parameters
+        ----------
+        epsilon: float
+            The probability of selecting a random move in the rollouts.
+
+        Returns
+        -------
+        simulations: int
+            The number of simulations performed.
+        '''
+        leaf_nodes = []
+        evaluations = []
+        for _ in range(self.batch_size):
+            leaf_node: Node = self.search()
+            # Looked up before the virtual loss makes the leaf look visited
+            evaluations.append(self.transposition_value(leaf_node))
+            leaf_node.tree.add_virtual_loss(leaf_node.index, self.virtual_loss)
+            leaf_nodes.append(leaf_node)
+
+        pending = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+        pending_nodes = [leaf_nodes[i] for i in pending]
+        if pending_nodes and self.evaluation == 'value':
+            pending_evaluations = ValuePolicy(self.neural_network, self.use_priors).evaluate_batch(pending_nodes)
+        elif pending_nodes:
+            target_policy = TargetPolicy(self.neural_network)
+            pending_evaluations = target_policy.evaluate_batch(pending_nodes, epsilon)
+        else:
+            pending_evaluations = []
+        for i, evaluation in zip(pending, pending_evaluations):
+            evaluations[i] = evaluation
+        for leaf_node, evaluation in zip(leaf_nodes, evaluations):
+            leaf_node.tree.remove_virtual_loss(leaf_node.index, self.virtual_loss)
+            self.backpropagate(leaf_node, evaluation)
+        return len(leaf_nodes)
+
+    def update_root(self, child_node: Node):
+        '''
+        Promote a child of the root node to be the new root. The subtree of the
+        child is kept with its statistics, so the next search continues from the
+        inherited visit counts, while the old root and the siblings are freed.
+
+        Parameters
+        ----------
+        child_node: Node
+            The child of the root node to promote.
+        '''
+        # The state of the new root must exist before its parent is dropped
+        child_node.tree.get_state(child_node.index)
+        self.root_node = Node(tree=child_node.tree.subtree(child_node.index), index=0)
+
     def backpropagate(self, node: Node, value: int):
         '''
         Backpropagate the evaluation of a final state back up the tree, updating relevant
-        data at all nodes and edges on the path from the final state to the tree root.
+        data at all nodes and edges on the path from the final state to the tree root,
+        and the entries of their positions in the transposition table.
 
         Parameters
         ----------
@@ -94,9 +345,195 @@ class MCTS:
         value: int
             The value of the current node.
         '''
-        node.update(value)
-        if node.parent is not None:
-            self.backpropagate(node.parent, value)
+        node.tree.backpropagate(node.index, value)
+        if self.transposition_table is not None:
+            tree = node.tree
+            self.transposition_table.update(
+                [tree.get_state(index).get_hash() for index in tree.path(node.index)], value)
+
+    def within_budget(self, start_time: float, simulations: int, n_simulations: int) -> bool:
+        '''
+        Check if the search may perform another simulation.
+
+        Parameters
+        ----------
+        start_time: float
+            The start time of the search.
+        simulations: int
+            The number of simulations performed.
+        n_simulations: int
+            The number of simulations to perform.
+
+        Returns
+        -------
+        within_budget: bool
+            True while the time limit or the number of simulations is not reached,
+            and the maximum time limit is not exceeded.
+        '''
+        elapsed = time.time() - start_time
+        return (elapsed < self.time_limit or simulations < n_simulations) and elapsed < MAX_TIME_LIMIT
+
+    def simulate(self, epsilon: float = None) -> int:
+        '''
+        Performing simulations from the root node until the budget is spent.
+
+        Parameters
+        ----------
+        epsilon: float
+            The probability of selecting a random move in the rollouts.
+
+        Returns
+        -------
+        simulations: int
+            The number of simulations performed.
+        '''
+        start_time = time.time()
+        simulations = 0
+
+        while self.within_budget(start_time, simulations, self.n_simulations):
+            if self.neural_network and self.batch_size > 1:
+                simulations += self.batch_leaf_evaluation(epsilon)
+                continue
+            leaf_node: Node = self.search()
+            evaluation = self.leaf_evaluation(leaf_node, epsilon)
+            self.backpropagate(leaf_node, evaluation)
+            simulations += 1
+        return simulations
+
+    def tree_parallel_search(self, epsilon: float = None) -> int:
+        '''
+        Performing simulations with several threads sharing the tree. Selection,
+        expansion and backpropagation hold a lock, while the leaves are evaluated
+        on copies of their states outside of it. A virtual loss on the path of
+        every leaf being evaluated spreads the threads over the tree. The threads
+        run concurrently while the evaluation releases the GIL, as the neural
+        network does.
+
+        Parameters
+        ----------
+        epsilon: float
+            The probability of selecting a random move in the rollouts.
+
+        Returns
+        -------
+        simulations: int
+            The number of simulations performed.
+        '''
+        start_time = time.time()
+        lock = threading.Lock()
+        simulations = 0
+
+        def worker():
+            nonlocal simulations
+            while True:
+                with lock:
+                    if not self.within_budget(start_time, simulations, self.n_simulations):
+                        return
+                    simulations += 1
+                    leaf_node: Node = self.search()
+                    leaf_node.tree.add_virtual_loss(leaf_node.index, self.virtual_loss)
+                    state = leaf_node.state.copy()
+
+                if self.neural_network and self.evaluation == 'value':
+                    evaluation = ValuePolicy(self.neural_network, self.use_priors)(leaf_node)
+                elif self.neural_network:
+                    evaluation = TargetPolicy(self.neural_network).rollout(state, epsilon)
+                else:
+                    evaluation = DefaultPolicy().rollout(state)
+
+                with lock:
+                    leaf_node.tree.remove_virtual_loss(leaf_node.index, self.virtual_loss)
+                    self.backpropagate(leaf_node, evaluation)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return simulations
+
+    def root_parallel_search(self, epsilon: float = None) -> int:
+        '''
+        Performing independent searches from the root state in a process pool, each
+        with an equal share of the simulations, and adding the visit counts and
+        values of their root children to the children of the root node.
+
+        Parameters
+        ----------
+        epsilon: float
+            The probability of selecting a random move in the rollouts.
+
+        Returns
+        -------
+        simulations: int
+            The number of simulations performed.
+        '''
+        options = {
+            'batch_size': self.batch_size,
+            'virtual_loss': self.virtual_loss,
+            'evaluation': self.evaluation,
+            'tree_policy': 'puct' if self.use_priors else 'uct',
+            'c_puct': self.c_puct,
+            'transposition_table_size': 0 if self.transposition_table is None else self.transposition_table.capacity,
+        }
+        n_simulations = math.ceil(self.n_simulations / self.workers)
+        futures = [self.get_executor().submit(
+            root_parallel_worker, self.root_node.state, n_simulations, self.time_limit, epsilon, options)
+            for _ in range(self.workers)]
+
+        root_node = self.root_node
+        if root_node.is_leaf():
+            root_node.expand()
+            if self.use_priors:
+                self.expand_priors(root_node)
+        tree = root_node.tree
+        children = tree.children(root_node.index)
+        positions = {action: position for position, action in enumerate(tree.action[children])}
+
+        simulations = 0
+        for future in futures:
+            actions, visits, values, worker_simulations = future.result()
+            child_ids = children.start + np.array([positions[action] for action in actions], dtype=np.int32)
+            tree.visits[child_ids] += visits
+            tree.value[child_ids] += values
+            tree.visits[root_node.index] += visits.sum()
+            tree.value[root_node.index] += values.sum()
+            simulations += worker_simulations
+        return simulations
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        '''
+        Return the process pool of the root parallelization, starting it on first use.
+        Each process holds a copy of the neural network.
+
+        Returns
+        -------
+        executor: ProcessPoolExecutor
+            The process pool.
+        '''
+        if self.executor is None:
+            weights, value_head, network = None, False, None
+            if isinstance(self.neural_network, NumpyNet):
+                network = self.neural_network
+            elif self.neural_network:
+                if not hasattr(self.neural_network, 'model'):
+                    raise ValueError('Root parallelization needs a neural network with a model')
+                weights = self.neural_network.model.get_weights()
+                value_head = self.neural_network.value_head
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp.get_context('spawn'),
+                initializer=init_root_parallel_worker,
+                initargs=(weights, value_head, network))
+        return self.executor
+
+    def close(self):
+        '''
+        Stop the process pool of the root parallelization.
+        '''
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
     def __call__(self, epsilon: float = None) -> tuple[Node, list]:
         '''
@@ -114,16 +551,11 @@ class MCTS:
         distribution: list
             The visit count distribution of the children of the root node.
         '''
-        start_time = time.time()
-        simulations = 0
-        MAX_TIME_LIMIT = 10
- 
-
-        while (time.time() - start_time < self.time_limit or simulations < self.n_simulations) and (time.time() - start_time < MAX_TIME_LIMIT):
-            test_time = time.time()
-            leaf_node: Node = self.search()
-            evaluation = self.leaf_evaluation(leaf_node, epsilon)
-            self.backpropagate(leaf_node, evaluation)
-            simulations += 1
+        if self.workers > 1 and self.parallel == 'root':
+            simulations = self.root_parallel_search(epsilon)
+        elif self.workers > 1:
+            simulations = self.tree_parallel_search(epsilon)
+        else:
+            simulations = self.simulate(epsilon)
         print("Simulations: ", simulations)
-        return self.root_node.get_best_child(), self.root_node.visit_count_distribution()
\ No newline at end of file
+        return self.root_node.get_best_child(), self.root_node.visit_count_distribution()
@@ -0,0 +1,126 @@
+'''
+This module contains the TranspositionTable class, which shares statistics
+between the nodes of positions reached by different move orders.
+'''
+from collections import OrderedDict
+import numpy as np
+
+
+class TranspositionTable:
+    '''
+    A bounded table of statistics keyed by the hash of a position. Every entry
+    holds the visit count and value sum of the position over all the nodes
+    reaching it, and the policy predicted for it by the neural network. When
+    the table is full, the least recently used entry is replaced.
+
+    Parameters
+    ----------
+    capacity : int
+        The maximum number of positions in the table.
+    '''
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: OrderedDict[int, list] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def entry(self, key: int) -> list:
+        '''
+        Return the [visits, value, policy] entry of a position, adding an empty
+        one and evicting the least recently used entry if needed.
+
+        Parameters
+        ----------
+        key : int
+            The hash of the position.
+
+        Returns
+        -------
+        entry : list
+            The entry of the position.
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0, 0.0, None]
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def value(self, key: int) -> float:
+        '''
+        Return the mean value of a position, or None if it was never evaluated.
+
+        Parameters
+        ----------
+        key : int
+            The hash of the position.
+
+        Returns
+        -------
+        value : float
+            The mean of the evaluations backpropagated through the position.
+        '''
+        entry = self.entries.get(key)
+        if entry is None or entry[0] == 0:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1] / entry[0]
+
+    def policy(self, key: int) -> np.ndarray:
+        '''
+        Return the policy predicted for a position, or None if there is none.
+
+        Parameters
+        ----------
+        key : int
+            The hash of the position.
+
+        Returns
+        -------
+        policy : np.ndarray
+            The probability of each action.
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[2]
+
+    def store_policy(self, key: int, policy: np.ndarray):
+        '''
+        Store the policy predicted for a position.
+
+        Parameters
+        ----------
+        key : int
+            The hash of the position.
+        policy : np.ndarray
+            The probability of each action.
+        '''
+        self.entry(key)[2] = policy
+
+    def update(self, keys: list[int], value: float):
+        '''
+        Add one visit and an evaluation to the positions on a path.
+
+        Parameters
+        ----------
+        keys : list of int
+            The hashes of the positions.
+        value : float
+            The evaluation to add.
+        '''
+        for key in keys:
+            entry = self.entry(key)
+            entry[0] += 1
+            entry[1] += value
+
+    def clear(self):
+        '''
+        Remove every entry.
+        '''
+        self.entries.clear()
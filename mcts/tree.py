@@ -0,0 +1,400 @@
+'''
+This module contains the Tree class, which stores the search tree as a
+structure of arrays indexed by node id.
+'''
+import random
+import numpy as np
+from game import State
+
+
+class Tree:
+    '''
+    The Tree class stores the statistics of every node of the search tree in
+    preallocated NumPy arrays, indexed by node id. The children of a node occupy
+    a contiguous range of ids, so the statistics of all children can be read
+    with one slice. The arrays grow by doubling when they are full.
+
+    Attributes
+    ----------
+    size : int
+        The number of nodes in the tree.
+    parent : np.ndarray
+        The id of the parent of each node, -1 for the root.
+    first_child : np.ndarray
+        The id of the first child of each node, -1 if the node has no children.
+    num_children : np.ndarray
+        The number of children of each node.
+    action : np.ndarray
+        The flat board index of the action leading to each node, -1 for the root.
+    player : np.ndarray
+        The player to move in the state of each node.
+    visits : np.ndarray
+        The visit count of each node.
+    value : np.ndarray
+        The sum of the evaluations backpropagated through each node.
+    prior : np.ndarray
+        The prior probability of the action leading to each node.
+    states : list of State
+        The state of each node. None until the state of the node is requested.
+    policies : dict of int to np.ndarray
+        Policies predicted for nodes that are not expanded yet, used to set the
+        priors of their children when they are expanded.
+    '''
+
+    COLUMNS = {
+        'parent': (np.int32, -1),
+        'first_child': (np.int32, -1),
+        'num_children': (np.int32, 0),
+        'action': (np.int32, -1),
+        'player': (np.int8, 0),
+        'visits': (np.int64, 0),
+        'value': (np.float64, 0),
+        'prior': (np.float32, 0),
+    }
+
+    def __init__(self, capacity: int = 1024):
+        self.size: int = 0
+        self.capacity: int = capacity
+        for name, (dtype, fill) in self.COLUMNS.items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+        self.states: list[State] = []
+        self.policies: dict[int, np.ndarray] = {}
+
+    def grow(self, min_capacity: int):
+        '''
+        Double the capacity of the arrays until they hold at least min_capacity nodes.
+
+        Parameters
+        ----------
+        min_capacity : int
+            The number of nodes the arrays must hold.
+        '''
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for name, (dtype, fill) in self.COLUMNS.items():
+            column = np.full(capacity, fill, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def allocate(self, n_nodes: int) -> int:
+        '''
+        Allocate ids for n_nodes new nodes.
+
+        Parameters
+        ----------
+        n_nodes : int
+            The number of nodes to allocate.
+
+        Returns
+        -------
+        first_id : int
+            The id of the first allocated node.
+        '''
+        first_id = self.size
+        if first_id + n_nodes > self.capacity:
+            self.grow(first_id + n_nodes)
+        self.size += n_nodes
+        self.states.extend([None] * n_nodes)
+        return first_id
+
+    def add_root(self, state: State) -> int:
+        '''
+        Add a root node to the tree.
+
+        Parameters
+        ----------
+        state : State
+            The state of the root node.
+
+        Returns
+        -------
+        root : int
+            The id of the root node.
+        '''
+        root = self.allocate(1)
+        self.player[root] = state.player
+        self.states[root] = state
+        return root
+
+    def add_actions(self, node: int, actions: list[int]) -> range:
+        '''
+        Add one child node per action to a node, without creating their states.
+        The state of a child is created from the state of its parent the first
+        time it is requested with get_state. The children of a node must be
+        contiguous, so children can only be added to a node without children, or
+        to the node whose children were the last ones allocated.
+
+        Parameters
+        ----------
+        node : int
+            The id of the parent node.
+        actions : list of int
+            The flat board indices of the actions leading to the child nodes.
+
+        Returns
+        -------
+        children : range
+            The ids of the new child nodes.
+        '''
+        n_children = len(actions)
+        first_child = self.first_child[node]
+        if first_child == -1:
+            first_child = self.size
+        elif first_child + self.num_children[node] != self.size:
+            raise ValueError('The children of a node must be contiguous')
+
+        first_id = self.allocate(n_children)
+        children = slice(first_id, first_id + n_children)
+        self.first_child[node] = first_child
+        self.num_children[node] += n_children
+        self.parent[children] = node
+        self.action[children] = actions
+        # Players alternate, so the player to move is known before the state exists
+        self.player[children] = 1 - self.player[node]
+        return range(first_id, first_id + n_children)
+
+    def add_children(self, node: int, child_states: list[State]) -> range:
+        '''
+        Add child nodes with existing states to a node.
+
+        Parameters
+        ----------
+        node : int
+            The id of the parent node.
+        child_states : list of State
+            The states of the child nodes.
+
+        Returns
+        -------
+        children : range
+            The ids of the new child nodes.
+        '''
+        actions = [child_state.action_to_index(child_state.get_previous_action())
+                   for child_state in child_states]
+        children = self.add_actions(node, actions)
+        for child, child_state in zip(children, child_states):
+            self.player[child] = child_state.player
+            self.states[child] = child_state
+        return children
+
+    def get_state(self, node: int) -> State:
+        '''
+        Return the state of a node, creating it and the states of its ancestors
+        from the closest ancestor with a state if needed.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+
+        Returns
+        -------
+        state : State
+            The state of the node.
+        '''
+        missing = []
+        while self.states[node] is None:
+            missing.append(node)
+            node = self.parent[node]
+        state = self.states[node]
+        for node in reversed(missing):
+            state = state.copy()
+            state.produce_successor_state(state.index_to_action(self.action[node]))
+            self.states[node] = state
+        return state
+
+    def set_priors(self, node: int, policy: np.ndarray):
+        '''
+        Set the priors of the children of a node from a policy over all actions.
+        The policy is renormalized over the actions of the children.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+        policy : np.ndarray
+            The probability of each action, indexed by action.
+        '''
+        children = self.children(node)
+        priors = policy[self.action[children]]
+        total = priors.sum()
+        if total > 0:
+            self.prior[children] = priors / total
+        else:
+            self.prior[children] = 1 / len(priors)
+
+    def children(self, node: int) -> slice:
+        '''
+        Return the ids of the children of a node as a slice.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+
+        Returns
+        -------
+        children : slice
+            The slice of the children in the arrays.
+        '''
+        first_child = self.first_child[node]
+        if first_child == -1:
+            return slice(0, 0)
+        return slice(first_child, first_child + self.num_children[node])
+
+    def path(self, node: int) -> np.ndarray:
+        '''
+        Return the ids of the nodes from a node up to the root.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+
+        Returns
+        -------
+        path : np.ndarray
+            The ids of the nodes on the path.
+        '''
+        path = []
+        while node != -1:
+            path.append(node)
+            node = self.parent[node]
+        return np.array(path, dtype=np.int32)
+
+    def backpropagate(self, node: int, value: float):
+        '''
+        Add one visit and the value to every node from a node up to the root.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+        value : float
+            The evaluation to backpropagate.
+        '''
+        path = self.path(node)
+        self.visits[path] += 1
+        self.value[path] += value
+
+    def add_virtual_loss(self, node: int, virtual_loss: int):
+        '''
+        Add a virtual loss to every node from a node up to the root, so that the
+        tree policy avoids this path until the evaluation of the node is done.
+        Each node gets extra visits and a value that is worse for the player
+        choosing it, which is the opponent of the player to move in the node.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+        virtual_loss : int
+            The number of virtual visits, each of them lost.
+        '''
+        path = self.path(node)
+        self.visits[path] += virtual_loss
+        self.value[path] += virtual_loss * (2 * self.player[path] - 1)
+
+    def remove_virtual_loss(self, node: int, virtual_loss: int):
+        '''
+        Remove a virtual loss added by add_virtual_loss.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+        virtual_loss : int
+            The number of virtual visits, each of them lost.
+        '''
+        path = self.path(node)
+        self.visits[path] -= virtual_loss
+        self.value[path] -= virtual_loss * (2 * self.player[path] - 1)
+
+    def subtree(self, node: int) -> 'Tree':
+        '''
+        Return a new tree holding the subtree of a node, with the node as root.
+        The nodes are renumbered in breadth-first order, which keeps the children
+        of every node contiguous. The rest of the tree is left behind, so it can
+        be freed.
+
+        Parameters
+        ----------
+        node : int
+            The id of the new root.
+
+        Returns
+        -------
+        tree : Tree
+            The subtree, with the statistics of its nodes.
+        '''
+        levels = [np.array([node], dtype=np.int32)]
+        while True:
+            level = levels[-1]
+            expanded = level[self.first_child[level] != -1]
+            counts = self.num_children[expanded]
+            if counts.sum() == 0:
+                break
+            starts = np.repeat(self.first_child[expanded] - (np.cumsum(counts) - counts), counts)
+            levels.append((starts + np.arange(counts.sum())).astype(np.int32))
+        order = np.concatenate(levels)
+
+        new_ids = np.full(self.size, -1, dtype=np.int32)
+        new_ids[order] = np.arange(len(order), dtype=np.int32)
+
+        capacity = self.capacity
+        while capacity // 2 >= max(len(order), 1024):
+            capacity //= 2
+        tree = Tree(capacity)
+        tree.size = len(order)
+        for name in self.COLUMNS:
+            getattr(tree, name)[:tree.size] = getattr(self, name)[order]
+        first_child = self.first_child[order]
+        tree.first_child[:tree.size] = np.where(first_child != -1, new_ids[first_child], -1)
+        tree.parent[:tree.size] = new_ids[self.parent[order]]
+        tree.parent[0] = -1
+        tree.states = [self.states[old_id] for old_id in order]
+        tree.policies = {int(new_ids[old_id]): policy for old_id, policy in self.policies.items()
+                         if new_ids[old_id] != -1}
+        return tree
+
+    def visit_count_distribution(self, node: int, n_actions: int) -> np.ndarray:
+        '''
+        Return the visit count distribution over the actions of a node.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+        n_actions : int
+            The number of actions of the game.
+
+        Returns
+        -------
+        distribution : np.ndarray
+            The visit count distribution, indexed by action.
+        '''
+        children = self.children(node)
+        distribution = np.zeros(n_actions)
+        distribution[self.action[children]] = self.visits[children]
+        return distribution / distribution.sum()
+
+    def best_child(self, node: int) -> int:
+        '''
+        Return the most visited child of a node, breaking ties randomly.
+
+        Parameters
+        ----------
+        node : int
+            The id of the node.
+
+        Returns
+        -------
+        best_child : int
+            The id of the best child.
+        '''
+        children = self.children(node)
+        visits = self.visits[children]
+        best_children = np.flatnonzero(visits == visits.max())
+        return children.start + int(random.choice(best_children))
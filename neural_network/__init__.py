@@ -1 +1,13 @@
-from .anet import ANet, load_models
+from .backend import load_networks, BACKENDS
+from .checkpoints import CheckpointRegistry
+from .inference_cache import InferenceCache
+from .inference_server import InferenceServer, InferenceClient
+from .numpy_net import NumpyNet
+
+
+def __getattr__(name):
+    # ANet and load_models import TensorFlow, so they are only loaded when used
+    if name in ('ANet', 'load_models'):
+        from . import anet
+        return getattr(anet, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
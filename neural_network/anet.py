@@ -1,16 +1,33 @@
 '''
 This module contains a class to build a neural network model by using tf.Keras
 '''
+import os
 from math import sqrt
 import tensorflow as tf
 import numpy as np
 from enum import Enum
-from config import INPUT_SHAPE, OUTPUT_SHAPE, LAYERS, ACTIVATION, OPTIMIZER, LEARNING_RATE, DATE
+from config import INPUT_SHAPE, OUTPUT_SHAPE, LAYERS, ACTIVATION, OPTIMIZER, LEARNING_RATE, DATE, VALUE_HEAD, \
+    INFERENCE_CACHE_SIZE
+from .checkpoints import CheckpointRegistry
+from .inference_cache import CachedInference, InferenceCache
 
 
-class ANet:
+class ANet(CachedInference):
     '''
     A neural network model. Implmentation of ANet is based on tf.Keras.
+
+    With value_head, the model has two outputs: a softmax policy over the
+    actions and a tanh value estimating the winner of the game, 1 for the
+    maximizer and -1 for the minimizer.
+
+    With cache_size, the outputs of the last cache_size positions are kept in
+    an InferenceCache, so positions seen before, like the openings, skip the
+    model. The version of the weights is increased by train and set_weights,
+    which empties the cache.
+
+    With model, the given Keras model is used, and the arguments of its
+    architecture are read from its layers, so it is saved like a model built
+    by ANet.
     '''
 
     def __init__(
@@ -22,9 +39,15 @@ class ANet:
         optimizer: str = OPTIMIZER,
         learning_rate: float = LEARNING_RATE,
         model: tf.keras.Model = None,
+        value_head: bool = VALUE_HEAD,
+        cache_size: int = INFERENCE_CACHE_SIZE,
     ):
+        self.version = 0
+        self.cache = InferenceCache(cache_size) if cache_size > 0 else None
         if model:
             self.model: tf.keras.Model = model
+            self.value_head = len(model.outputs) > 1
+            self.read_architecture(optimizer, learning_rate)
         else:
             self.input_shape = input_shape
             self.output_shape = output_shape
@@ -32,8 +55,38 @@ class ANet:
             self.activation = activation
             self.optimizer = optimizer
             self.learning_rate = learning_rate
+            self.value_head = value_head
             self.model: tf.keras.Model = self.build_model()
 
+    def read_architecture(self, optimizer: str, learning_rate: float):
+        '''
+        Read the arguments of the architecture from the given model. The
+        optimizer and learning rate of a compiled model are used, otherwise the
+        given ones.
+
+        Parameters
+        ----------
+        optimizer : str
+            The optimizer of a model that is not compiled
+        learning_rate : float
+            The learning rate of a model that is not compiled
+        '''
+        dense_layers = [layer for layer in self.model.layers
+                        if isinstance(layer, tf.keras.layers.Dense)]
+        # The policy head, and the value head if there is one, are the last Dense layers
+        hidden_layers = dense_layers[:-len(self.model.outputs)]
+        self.input_shape = int(self.model.input_shape[-1])
+        self.output_shape = int(self.model.outputs[0].shape[-1])
+        self.layers = [int(layer.units) for layer in hidden_layers]
+        self.activation = hidden_layers[0].get_config()['activation'] if hidden_layers else ACTIVATION
+        if self.model.optimizer is not None:
+            config = self.model.optimizer.get_config()
+            if config['name'].lower() in [member.value for member in Optimizer]:
+                optimizer = config['name'].lower()
+                learning_rate = float(config['learning_rate'])
+        self.optimizer = optimizer
+        self.learning_rate = learning_rate
+
     def build_model(self) -> tf.keras.Model:
         '''
         Build a neural network model
@@ -43,74 +96,122 @@ class ANet:
         tf.keras.Model
             A neural network model
         '''
-        model = tf.keras.Sequential()
-        model.add(tf.keras.layers.InputLayer(input_shape=self.input_shape))
-        for layer in self.layers:
-            model.add(tf.keras.layers.Dense(layer, activation=self.activation))
-        model.add(tf.keras.layers.Dense(
-            self.output_shape, activation=Activation.SOFTMAX.value))
-
         match self.optimizer:
             case Optimizer.ADAGRAD.value:
-                model.compile(optimizer=tf.keras.optimizers.Adagrad(learning_rate=self.learning_rate),
-                              loss=tf.keras.losses.BinaryCrossentropy(),
-                              metrics=[tf.keras.metrics.CategoricalAccuracy()])
+                optimizer = tf.keras.optimizers.Adagrad(learning_rate=self.learning_rate)
             case Optimizer.ADAM.value:
-                model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=self.learning_rate),
-                              loss=tf.keras.losses.BinaryCrossentropy(),
-                              metrics=[tf.keras.metrics.CategoricalAccuracy()])
+                optimizer = tf.keras.optimizers.Adam(learning_rate=self.learning_rate)
             case Optimizer.RMSPROP.value:
-                model.compile(optimizer=tf.keras.optimizers.RMSprop(learning_rate=self.learning_rate),
-                              loss=tf.keras.losses.BinaryCrossentropy(),
-                              metrics=[tf.keras.metrics.CategoricalAccuracy()])
+                optimizer = tf.keras.optimizers.RMSprop(learning_rate=self.learning_rate)
             case Optimizer.SGD.value:
-                model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=self.learning_rate),
-                              loss=tf.keras.losses.BinaryCrossentropy(),
-                              metrics=[tf.keras.metrics.CategoricalAccuracy()])
+                optimizer = tf.keras.optimizers.SGD(learning_rate=self.learning_rate)
             case _:
                 raise ValueError('Invalid optimizer')
 
+        if not self.value_head:
+            model = tf.keras.Sequential()
+            model.add(tf.keras.layers.InputLayer(input_shape=self.input_shape))
+            for layer in self.layers:
+                model.add(tf.keras.layers.Dense(layer, activation=self.activation))
+            model.add(tf.keras.layers.Dense(
+                self.output_shape, activation=Activation.SOFTMAX.value))
+            model.compile(optimizer=optimizer,
+                          loss=tf.keras.losses.BinaryCrossentropy(),
+                          metrics=[tf.keras.metrics.CategoricalAccuracy()])
+            return model
+
+        inputs = tf.keras.Input(shape=self.input_shape)
+        hidden = inputs
+        for layer in self.layers:
+            hidden = tf.keras.layers.Dense(layer, activation=self.activation)(hidden)
+        policy = tf.keras.layers.Dense(
+            self.output_shape, activation=Activation.SOFTMAX.value, name='policy')(hidden)
+        value = tf.keras.layers.Dense(
+            1, activation=Activation.TANH.value, name='value')(hidden)
+        model = tf.keras.Model(inputs=inputs, outputs=[policy, value])
+        model.compile(optimizer=optimizer,
+                      loss={'policy': tf.keras.losses.BinaryCrossentropy(),
+                            'value': tf.keras.losses.MeanSquaredError()},
+                      metrics={'policy': [tf.keras.metrics.CategoricalAccuracy()]})
         return model
 
-    def train(self, minibatch: list[tuple]):
+    def train(self, minibatch: tuple[np.ndarray, np.ndarray, np.ndarray]):
         '''
         Train the neural network model
 
         Parameters
         ----------
-        minibatch : list[tuple]
-            A minibatch of cases
+        minibatch : tuple[np.ndarray, np.ndarray, np.ndarray]
+            A minibatch of cases, as arrays of state representations, visit count
+            distributions and outcomes of the games. The outcomes are the targets
+            of the value head.
         '''
-        feature_matrix = []
-        probability_distribution = []
+        feature_matrix, probability_distribution, outcomes = minibatch
+        if self.value_head:
+            self.model.fit(feature_matrix, {'policy': probability_distribution,
+                                            'value': outcomes})
+        else:
+            self.model.fit(feature_matrix, probability_distribution)
+        self.version += 1
 
-        for sample in minibatch:
-            feature_matrix.append(sample[0])
-            probability_distribution.append(sample[1])
+    def set_weights(self, weights: list):
+        '''
+        Replace the weights of the neural network model
 
-        feature_matrix = np.array(feature_matrix)
-        probability_distribution = np.array(probability_distribution)
-        self.model.fit(feature_matrix, probability_distribution)
+        Parameters
+        ----------
+        weights : list
+            The weights as NumPy arrays
+        '''
+        self.model.set_weights(weights)
+        self.version += 1
 
-    def predict(self, node_features: np.ndarray):
+    def run_model(self, node_features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
         '''
-        Predict the value of the state
+        Run the model on a batch of states
 
         Parameters
         ----------
-        state : numpy.ndarray
-            A state of the game
+        node_features : numpy.ndarray
+            A batch of states of the game
 
         Returns
         -------
         numpy.ndarray
-            A value of the state
+            The probability distribution over the actions of each state
+        numpy.ndarray
+            The value of each state, or None without a value head
+        '''
+        # Calling the model directly avoids the per-call overhead of model.predict on small batches
+        outputs = self.model(node_features, training=False)
+        if self.value_head:
+            policy, value = outputs
+            return np.asarray(policy), np.asarray(value)[:, 0]
+        return np.asarray(outputs), None
+
+    def architecture(self) -> dict:
         '''
-        return self.model.predict(node_features, verbose=0)
+        Return the arguments needed to build the same neural network model
+
+        Returns
+        -------
+        dict
+            The keyword arguments of ANet
+        '''
+        return {
+            'input_shape': self.input_shape,
+            'output_shape': self.output_shape,
+            'layers': self.layers,
+            'activation': self.activation,
+            'optimizer': self.optimizer,
+            'learning_rate': self.learning_rate,
+            'value_head': self.value_head,
+        }
 
     def save(self, identifier: str, epoch: int):
         '''
-        Save the neural network model
+        Save the neural network model, as a SavedModel and as a compact weights
+        checkpoint of the CheckpointRegistry
 
         Parameters
         ----------
@@ -120,17 +221,20 @@ class ANet:
             The number of epochs
         '''
         board_size = int(sqrt(self.output_shape))
-        self.model.save(
-            f'models/{board_size}x{board_size}/{DATE}/{identifier}_{epoch}')
+        directory = f'models/{board_size}x{board_size}/{DATE}'
+        self.model.save(f'{directory}/{identifier}_{epoch}')
+        CheckpointRegistry.save(self, directory, identifier, epoch)
 
 
 def load_models(
     identifier: str,
     M: int,
     board_size: int,
-) -> tf.keras.Model:
+) -> list[tf.keras.Model]:
     '''
-    Load the neural network model
+    Load the neural network models. The compact checkpoints of the
+    CheckpointRegistry are used when they exist, otherwise the SavedModel
+    directories are loaded.
 
     Parameters
     ----------
@@ -145,23 +249,22 @@ def load_models(
 
     Returns
     -------
-    tf.keras.Model
-        A neural network model
+    list[tf.keras.Model]
+        The neural network models found, in order
     '''
+    registry = CheckpointRegistry(identifier, board_size)
+    count = min(M, len(registry))
+    if count > 0:
+        return registry.load(list(range(count)))
+
     nets = []
-    try:
-        # nets = [tf.keras.models.load_model(
-        #     f'models/{board_size}x{board_size}/{DATE}/{identifier}_{i}') for i in range(M)]
-        for i in range(M):
-            nets.append(tf.keras.models.load_model(
-                f'models/{board_size}x{board_size}/{DATE}/{identifier}_{i}'))
-    except OSError as exc:
+    for i in range(M):
+        path = f'models/{board_size}x{board_size}/{DATE}/{identifier}_{i}'
+        if not os.path.exists(path):
+            break
+        nets.append(tf.keras.models.load_model(path))
+    if not nets:
         print('No model found')
-    except ValueError as exc:
-        print('Invalid model')
-    except Exception as exc:
-        print('Unexpected error')
-
     return nets
 
 
@@ -0,0 +1,61 @@
+'''
+This module contains the choice of the backend running the neural network for
+inference. Every backend has the prediction interface of CachedInference, and
+TensorFlow is only imported when the 'tensorflow' backend is used.
+'''
+import importlib.util
+import os
+from .checkpoints import CheckpointRegistry
+from .inference_cache import CachedInference
+from .numpy_net import NumpyNet
+
+BACKENDS = ('tensorflow', 'numpy')
+
+
+def load_networks(backend: str, registry: CheckpointRegistry, M: int, last_only: bool = False) -> list[CachedInference]:
+    '''
+    Load the neural networks of the first M checkpoints with a backend. The
+    compact checkpoints of the registry are used when they exist, otherwise
+    the SavedModel directories are loaded with TensorFlow. Without any
+    checkpoint, no network is returned and TensorFlow is not imported.
+
+    Parameters
+    ----------
+    backend : str
+        'tensorflow' to run the networks with ANet, 'numpy' with NumpyNet
+    registry : CheckpointRegistry
+        The registry of the checkpoints
+    M : int
+        The number of models
+    last_only : bool
+        Whether to only load the last of the M checkpoints
+
+    Returns
+    -------
+    list[CachedInference]
+        The neural networks found, in order
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(f'Invalid inference backend {backend}')
+
+    count = min(M, len(registry))
+    if count > 0:
+        indices = [count - 1] if last_only else list(range(count))
+        if backend == 'numpy':
+            return registry.load_numpy(indices)
+        from .anet import ANet
+        return [ANet(model=model) for model in registry.load(indices)]
+
+    if not os.path.exists(os.path.join(registry.directory, f'{registry.identifier}_0')):
+        return []
+    if backend == 'numpy' and importlib.util.find_spec('tensorflow') is None:
+        raise RuntimeError(
+            f'Only SavedModel checkpoints were found in {registry.directory}, which need '
+            'TensorFlow to be loaded. Install TensorFlow or use the tensorflow backend.')
+    from .anet import ANet, load_models
+    models = load_models(registry.identifier, M, registry.board_size)
+    if last_only:
+        models = models[-1:]
+    if backend == 'numpy':
+        return [NumpyNet.from_keras(model) for model in models]
+    return [ANet(model=model) for model in models]
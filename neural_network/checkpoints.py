@@ -0,0 +1,233 @@
+'''
+This module contains a registry of the checkpoints saved during training
+'''
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import DATE
+from .numpy_net import NumpyNet
+
+
+class CheckpointRegistry:
+    '''
+    A registry of the checkpoints of one training run. A checkpoint is stored
+    as a compact .npz file with the weights of the model, next to one JSON file
+    with the arguments of ANet shared by every checkpoint. The architecture is
+    built once, and every checkpoint is a clone of it with its own weights.
+    Checkpoints are loaded on demand and kept in memory.
+
+    Parameters
+    ----------
+    identifier : str
+        The identifier of the models
+    board_size : int
+        The size of the board
+    directory : str
+        The directory of the checkpoints, by default the one of the date in the configuration
+    '''
+
+    def __init__(self, identifier: str, board_size: int, directory: str = None):
+        self.identifier = identifier
+        self.board_size = board_size
+        self.directory = directory or f'models/{board_size}x{board_size}/{DATE}'
+        self.architecture: dict = None
+        self.base_model = None
+        self.models: dict = {}
+
+    @staticmethod
+    def save(anet, directory: str, identifier: str, epoch: int):
+        '''
+        Save the weights of a neural network as a checkpoint, and the arguments
+        of its architecture if they are not saved yet
+
+        Parameters
+        ----------
+        anet : ANet
+            The neural network
+        directory : str
+            The directory of the checkpoints
+        identifier : str
+            The identifier of the models
+        epoch : int
+            The number of the checkpoint
+        '''
+        os.makedirs(directory, exist_ok=True)
+        architecture_path = os.path.join(directory, f'{identifier}.architecture.json')
+        if not os.path.exists(architecture_path):
+            with open(architecture_path, 'w') as file:
+                json.dump(anet.architecture(), file)
+        np.savez(os.path.join(directory, f'{identifier}_{epoch}.weights.npz'),
+                 *anet.model.get_weights())
+
+    def weights_path(self, index: int) -> str:
+        '''
+        Return the path of the weights of a checkpoint
+        '''
+        return os.path.join(self.directory, f'{self.identifier}_{index}.weights.npz')
+
+    def __len__(self) -> int:
+        '''
+        Return the number of consecutive checkpoints saved from index 0
+        '''
+        count = 0
+        while os.path.exists(self.weights_path(count)):
+            count += 1
+        return count
+
+    def __contains__(self, index: int) -> bool:
+        return os.path.exists(self.weights_path(index))
+
+    def load_architecture(self) -> dict:
+        '''
+        Return the arguments of ANet shared by the checkpoints
+
+        Returns
+        -------
+        dict
+            The keyword arguments of ANet
+        '''
+        if self.architecture is None:
+            path = os.path.join(self.directory, f'{self.identifier}.architecture.json')
+            with open(path) as file:
+                self.architecture = json.load(file)
+        return self.architecture
+
+    def load_weights(self, index: int) -> list[np.ndarray]:
+        '''
+        Read the weights of a checkpoint
+
+        Parameters
+        ----------
+        index : int
+            The index of the checkpoint
+
+        Returns
+        -------
+        list[np.ndarray]
+            The weights of the model
+        '''
+        with np.load(self.weights_path(index)) as weights:
+            return [weights[f'arr_{i}'] for i in range(len(weights.files))]
+
+    def build_model(self, weights: list[np.ndarray]) -> 'tf.keras.Model':
+        '''
+        Return a clone of the architecture with the given weights
+
+        Parameters
+        ----------
+        weights : list[np.ndarray]
+            The weights of the model
+
+        Returns
+        -------
+        tf.keras.Model
+            The model
+        '''
+        # Imported here, so checkpoints can be loaded into NumpyNet without TensorFlow
+        import tensorflow as tf
+        from .anet import ANet
+
+        if self.base_model is None:
+            self.base_model = ANet(**self.load_architecture(), cache_size=0).model
+        model = tf.keras.models.clone_model(self.base_model)
+        model.set_weights(weights)
+        return model
+
+    def __getitem__(self, index: int) -> 'tf.keras.Model':
+        '''
+        Return the model of a checkpoint, loading it on first use
+
+        Parameters
+        ----------
+        index : int
+            The index of the checkpoint, negative to count from the last one
+
+        Returns
+        -------
+        tf.keras.Model
+            The model
+        '''
+        if index < 0:
+            index += len(self)
+        if index not in self.models:
+            if index not in self:
+                raise FileNotFoundError(f'No checkpoint {index} in {self.directory}')
+            self.models[index] = self.build_model(self.load_weights(index))
+        return self.models[index]
+
+    def load(self, indices: list[int], workers: int = 8) -> list['tf.keras.Model']:
+        '''
+        Return the models of several checkpoints. The weight files that are not
+        in memory yet are read in parallel.
+
+        Parameters
+        ----------
+        indices : list[int]
+            The indices of the checkpoints
+        workers : int
+            The number of threads reading the files
+
+        Returns
+        -------
+        list[tf.keras.Model]
+            The models
+        '''
+        missing = [index for index in indices if index not in self.models]
+        for index in missing:
+            if index not in self:
+                raise FileNotFoundError(f'No checkpoint {index} in {self.directory}')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            weights = list(executor.map(self.load_weights, missing))
+        for index, model_weights in zip(missing, weights):
+            self.models[index] = self.build_model(model_weights)
+        return [self.models[index] for index in indices]
+
+    def load_numpy(self, indices: list[int], workers: int = 8) -> list[NumpyNet]:
+        '''
+        Return the checkpoints as NumpyNet models, without TensorFlow. The
+        weight files are read in parallel.
+
+        Parameters
+        ----------
+        indices : list[int]
+            The indices of the checkpoints, negative to count from the last one
+        workers : int
+            The number of threads reading the files
+
+        Returns
+        -------
+        list[NumpyNet]
+            The models
+        '''
+        indices = [index + len(self) if index < 0 else index for index in indices]
+        for index in indices:
+            if index not in self:
+                raise FileNotFoundError(f'No checkpoint {index} in {self.directory}')
+        architecture = self.load_architecture()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            weights = list(executor.map(self.load_weights, indices))
+        return [NumpyNet(model_weights, architecture['activation'], architecture['value_head'])
+                for model_weights in weights]
+
+    def load_anet(self, index: int):
+        '''
+        Return a compiled ANet with the weights of a checkpoint, to continue training
+
+        Parameters
+        ----------
+        index : int
+            The index of the checkpoint, negative to count from the last one
+
+        Returns
+        -------
+        ANet
+            The neural network
+        '''
+        from .anet import ANet
+
+        if index < 0:
+            index += len(self)
+        anet = ANet(**self.load_architecture())
+        anet.set_weights(self.load_weights(index))
+        return anet
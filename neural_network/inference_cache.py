@@ -0,0 +1,236 @@
+'''
+This module contains a bounded cache of the outputs of the neural network, and
+the cached inference shared by the implementations of the neural network
+'''
+from collections import OrderedDict
+import threading
+import numpy as np
+
+
+class InferenceCache:
+    '''
+    A least recently used cache of the outputs of the neural network, keyed by
+    the position. A position is keyed by the bytes of its representation as
+    int8, which is exact for board representations of 0, 1 and -1. The cache is
+    tagged with the version of the weights and emptied when it changes. The
+    entries and counters are guarded by a lock, since the threads of a
+    tree-parallel search share the cache.
+
+    Parameters
+    ----------
+    capacity : int
+        The maximum number of positions in the cache
+    '''
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: OrderedDict[bytes, tuple] = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The lock cannot be pickled, so every copy sent to a process gets its own
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def hit_rate(self) -> float:
+        '''
+        The fraction of the looked up positions found in the cache
+        '''
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def keys(self, node_features: np.ndarray) -> list[bytes]:
+        '''
+        Return the key of every position of a batch
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        list[bytes]
+            The key of each state
+        '''
+        rows = np.ascontiguousarray(node_features, dtype=np.int8)
+        return [row.tobytes() for row in rows]
+
+    def validate(self, version: int):
+        '''
+        Empty the cache if the weights changed since the entries were stored
+
+        Parameters
+        ----------
+        version : int
+            The current version of the weights
+        '''
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def get(self, key: bytes) -> tuple:
+        '''
+        Return the (policy, value) of a position, or None if it is not cached
+
+        Parameters
+        ----------
+        key : bytes
+            The key of the position
+
+        Returns
+        -------
+        tuple
+            The policy and the value, None without a value head
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: bytes, policy: np.ndarray, value: float = None):
+        '''
+        Store the outputs for a position, evicting the least recently used
+        position when the cache is full
+
+        Parameters
+        ----------
+        key : bytes
+            The key of the position
+        policy : numpy.ndarray
+            The probability distribution over the actions
+        value : float
+            The value of the position, None without a value head
+        '''
+        with self.lock:
+            self.entries[key] = (policy, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove every entry and reset the counters
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class CachedInference:
+    '''
+    The prediction interface of the neural network, answering positions from
+    an InferenceCache when one is set. Subclasses run the model in run_model,
+    and set the attributes value_head, version and cache.
+    '''
+
+    value_head: bool = False
+    version: int = 0
+    cache: InferenceCache = None
+
+    def run_model(self, node_features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Run the model on a batch of states
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        numpy.ndarray
+            The value of each state, or None without a value head
+        '''
+        raise NotImplementedError
+
+    def infer(self, node_features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Run the model on a batch of states, reading the cached positions from
+        the inference cache and running the model once on the others
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        numpy.ndarray
+            The value of each state, or None without a value head
+        '''
+        node_features = np.atleast_2d(node_features)
+        if self.cache is None:
+            return self.run_model(node_features)
+
+        self.cache.validate(self.version)
+        keys = self.cache.keys(node_features)
+        entries = [self.cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            policies, values = self.run_model(node_features[missing])
+            for j, i in enumerate(missing):
+                entries[i] = (policies[j], None if values is None else values[j])
+                self.cache.put(keys[i], *entries[i])
+        policies = np.stack([entry[0] for entry in entries])
+        if not self.value_head:
+            return policies, None
+        return policies, np.array([entry[1] for entry in entries])
+
+    def predict(self, node_features: np.ndarray) -> np.ndarray:
+        '''
+        Predict the probability distribution over the actions of the states
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        '''
+        return self.infer(node_features)[0]
+
+    def evaluate(self, node_features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Predict the probability distribution over the actions and the value of the states
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        numpy.ndarray
+            The value of each state, between -1 and 1
+        '''
+        if not self.value_head:
+            raise ValueError('The model has no value head')
+        return self.infer(node_features)
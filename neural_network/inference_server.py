@@ -0,0 +1,220 @@
+'''
+This module contains an inference server, a process that owns one neural network
+and evaluates the requests of many MCTS workers in dynamic batches
+'''
+import multiprocessing as mp
+import queue
+import time
+import numpy as np
+from config import INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_US, VALUE_HEAD
+
+
+def inference_server(request_queue: mp.Queue, response_queues: list, max_batch_size: int, max_wait_us: int, value_head: bool):
+    '''
+    Serve evaluation requests until a stop message is received. After the first
+    request of a batch, more requests are gathered until the batch holds
+    max_batch_size positions or max_wait_us microseconds have passed. The batch
+    is then evaluated with one call to the neural network.
+
+    Parameters
+    ----------
+    request_queue : mp.Queue
+        The queue of messages. ('weights', weights) replaces the weights of the
+        network, ('predict', client_id, features) and ('evaluate', client_id,
+        features) are evaluation requests, and None stops the server.
+    response_queues : list of mp.Queue
+        The response queue of each client
+    max_batch_size : int
+        The maximum number of positions evaluated together
+    max_wait_us : int
+        The maximum time to wait for a batch to fill, in microseconds
+    value_head : bool
+        Whether the neural network has a value head
+    '''
+    # Imported here, so only the server process loads TensorFlow
+    from .anet import ANet
+
+    anet = ANet(value_head=value_head)
+    # A control message received while a batch is gathered, which is handled
+    # right after the batch is answered, before any later request
+    pending = []
+    while True:
+        message = pending.pop() if pending else request_queue.get()
+        if message is None:
+            return
+        if message[0] == 'weights':
+            anet.set_weights(message[1])
+            continue
+
+        requests = [message]
+        n_positions = len(message[2])
+        deadline = time.perf_counter() + max_wait_us / 1e6
+        while n_positions < max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                message = request_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if message is None or message[0] == 'weights':
+                pending.append(message)
+                break
+            requests.append(message)
+            n_positions += len(message[2])
+
+        features = np.concatenate([request[2] for request in requests])
+        if value_head:
+            policies, values = anet.evaluate(features)
+        else:
+            policies, values = anet.predict(features), None
+
+        start = 0
+        for kind, client_id, request_features in requests:
+            end = start + len(request_features)
+            if kind == 'evaluate':
+                response_queues[client_id].put((policies[start:end], values[start:end]))
+            else:
+                response_queues[client_id].put(policies[start:end])
+            start = end
+
+
+class InferenceClient:
+    '''
+    A client of the inference server, with the same prediction interface as ANet,
+    so it can be given to MCTS in place of the neural network
+
+    Parameters
+    ----------
+    client_id : int
+        The id of the client
+    request_queue : mp.Queue
+        The request queue of the server
+    response_queue : mp.Queue
+        The response queue of the client
+    value_head : bool
+        Whether the neural network of the server has a value head
+    '''
+
+    def __init__(self, client_id: int, request_queue: mp.Queue, response_queue: mp.Queue, value_head: bool):
+        self.client_id = client_id
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.value_head = value_head
+
+    def predict(self, node_features: np.ndarray) -> np.ndarray:
+        '''
+        Predict the probability distribution over the actions of the states
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        '''
+        self.request_queue.put(('predict', self.client_id, np.atleast_2d(node_features)))
+        return self.response_queue.get()
+
+    def evaluate(self, node_features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Predict the probability distribution over the actions and the value of the states
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        numpy.ndarray
+            The value of each state, between -1 and 1
+        '''
+        if not self.value_head:
+            raise ValueError('The model has no value head')
+        self.request_queue.put(('evaluate', self.client_id, np.atleast_2d(node_features)))
+        return self.response_queue.get()
+
+
+class InferenceServer:
+    '''
+    A process owning one neural network and serving many InferenceClient with
+    dynamic batching
+
+    Parameters
+    ----------
+    n_clients : int
+        The number of clients
+    max_batch_size : int
+        The maximum number of positions evaluated together
+    max_wait_us : int
+        The maximum time to wait for a batch to fill, in microseconds
+    value_head : bool
+        Whether the neural network has a value head
+    context : multiprocessing context
+        The context used to create the process and the queues
+    '''
+
+    def __init__(
+        self,
+        n_clients: int,
+        max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+        max_wait_us: int = INFERENCE_MAX_WAIT_US,
+        value_head: bool = VALUE_HEAD,
+        context=None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait_us = max_wait_us
+        self.value_head = value_head
+        self.context = context or mp.get_context('spawn')
+        self.request_queue = self.context.Queue()
+        self.response_queues = [self.context.Queue() for _ in range(n_clients)]
+        self.clients = [InferenceClient(client_id, self.request_queue, response_queue, value_head)
+                        for client_id, response_queue in enumerate(self.response_queues)]
+        self.process = None
+
+    def start(self, weights: list = None):
+        '''
+        Start the server process
+
+        Parameters
+        ----------
+        weights : list
+            The initial weights of the neural network
+        '''
+        if weights is not None:
+            self.update_weights(weights)
+        self.process = self.context.Process(
+            target=inference_server,
+            args=(self.request_queue, self.response_queues,
+                  self.max_batch_size, self.max_wait_us, self.value_head),
+            daemon=True)
+        self.process.start()
+
+    def update_weights(self, weights: list):
+        '''
+        Replace the weights of the neural network. Requests sent afterwards are
+        evaluated with the new weights.
+
+        Parameters
+        ----------
+        weights : list
+            The weights of the neural network
+        '''
+        self.request_queue.put(('weights', weights))
+
+    def close(self):
+        '''
+        Stop the server process
+        '''
+        self.request_queue.put(None)
+        if self.process is not None:
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
@@ -0,0 +1,180 @@
+'''
+This module contains a NumPy implementation of the forward pass of ANet, which
+runs the small dense models without TensorFlow
+'''
+import numpy as np
+from config import INFERENCE_CACHE_SIZE, INPUT_SHAPE, OUTPUT_SHAPE, LAYERS, ACTIVATION, VALUE_HEAD
+from .inference_cache import CachedInference, InferenceCache
+
+
+def relu(x: np.ndarray) -> np.ndarray:
+    '''
+    The rectified linear unit, computed in place
+    '''
+    return np.maximum(x, 0, out=x)
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    '''
+    The logistic function
+    '''
+    return 1 / (1 + np.exp(-x))
+
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    '''
+    The softmax of every row
+    '''
+    x = np.exp(x - x.max(axis=1, keepdims=True))
+    return x / x.sum(axis=1, keepdims=True)
+
+
+ACTIVATIONS = {
+    'relu': relu,
+    'sigmoid': sigmoid,
+    'tanh': np.tanh,
+    'softmax': softmax,
+    'linear': lambda x: x,
+}
+
+
+class NumpyNet(CachedInference):
+    '''
+    The forward pass of a dense ANet model with NumPy. The weights are kept as
+    contiguous float32 arrays, and every layer is one matrix product, so a
+    single position is evaluated in a few microseconds and TensorFlow is not
+    needed. It has the prediction interface of ANet, but cannot be trained.
+
+    Parameters
+    ----------
+    weights : list[np.ndarray]
+        The weights of the model in the order of Keras get_weights: the kernel
+        and bias of every hidden layer, then of the policy head, then of the
+        value head if there is one
+    activation : str
+        The activation of the hidden layers
+    value_head : bool
+        Whether the model has a value head
+    cache_size : int
+        The number of positions kept in the inference cache, 0 to disable it
+    '''
+
+    def __init__(self, weights: list[np.ndarray], activation: str, value_head: bool = False, cache_size: int = INFERENCE_CACHE_SIZE):
+        if activation not in ACTIVATIONS:
+            raise ValueError(f'Invalid activation {activation}')
+        self.activation = activation
+        self.value_head = value_head
+        self.version = 0
+        self.cache = InferenceCache(cache_size) if cache_size > 0 else None
+        self.set_weights(weights)
+
+    @classmethod
+    def from_keras(cls, model, cache_size: int = INFERENCE_CACHE_SIZE) -> 'NumpyNet':
+        '''
+        Export the weights of a Keras model built by ANet
+
+        Parameters
+        ----------
+        model : tf.keras.Model
+            The model
+        cache_size : int
+            The number of positions kept in the inference cache
+
+        Returns
+        -------
+        NumpyNet
+            The NumPy model
+        '''
+        dense_layers = [layer for layer in model.layers if layer.get_weights()]
+        activation = dense_layers[0].get_config()['activation']
+        return cls(model.get_weights(), activation, len(model.outputs) > 1, cache_size)
+
+    @classmethod
+    def initialize(
+        cls,
+        input_shape: int = INPUT_SHAPE,
+        output_shape: int = OUTPUT_SHAPE,
+        layers: list = LAYERS,
+        activation: str = ACTIVATION,
+        value_head: bool = VALUE_HEAD,
+    ) -> 'NumpyNet':
+        '''
+        Return an untrained model, initialized like the Dense layers of Keras:
+        Glorot uniform kernels and zero biases
+
+        Parameters
+        ----------
+        input_shape : int
+            The size of the input
+        output_shape : int
+            The number of actions
+        layers : list
+            The size of every hidden layer
+        activation : str
+            The activation of the hidden layers
+        value_head : bool
+            Whether the model has a value head
+
+        Returns
+        -------
+        NumpyNet
+            The NumPy model
+        '''
+        rng = np.random.default_rng()
+        sizes = [input_shape, *layers]
+        shapes = list(zip(sizes[:-1], sizes[1:])) + [(sizes[-1], output_shape)]
+        if value_head:
+            shapes.append((sizes[-1], 1))
+        weights = []
+        for fan_in, fan_out in shapes:
+            limit = np.sqrt(6 / (fan_in + fan_out))
+            weights += [rng.uniform(-limit, limit, size=(fan_in, fan_out)), np.zeros(fan_out)]
+        return cls(weights, activation, value_head)
+
+    def set_weights(self, weights: list[np.ndarray]):
+        '''
+        Replace the weights of the model
+
+        Parameters
+        ----------
+        weights : list[np.ndarray]
+            The weights in the order of Keras get_weights
+        '''
+        weights = [np.ascontiguousarray(weight, dtype=np.float32) for weight in weights]
+        layers = list(zip(weights[::2], weights[1::2]))
+        if self.value_head:
+            # The value head is the one with a single output
+            heads = layers[-2:]
+            if heads[0][0].shape[1] == 1:
+                heads.reverse()
+            self.hidden_layers, self.policy_head, self.value_layer = layers[:-2], heads[0], heads[1]
+        else:
+            self.hidden_layers, self.policy_head, self.value_layer = layers[:-1], layers[-1], None
+        self.version += 1
+
+    def run_model(self, node_features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Run the model on a batch of states
+
+        Parameters
+        ----------
+        node_features : numpy.ndarray
+            A batch of states of the game
+
+        Returns
+        -------
+        numpy.ndarray
+            The probability distribution over the actions of each state
+        numpy.ndarray
+            The value of each state, or None without a value head
+        '''
+        activation = ACTIVATIONS[self.activation]
+        hidden = np.asarray(node_features, dtype=np.float32)
+        for kernel, bias in self.hidden_layers:
+            hidden = activation(hidden @ kernel + bias)
+        kernel, bias = self.policy_head
+        policy = softmax(hidden @ kernel + bias)
+        if self.value_layer is None:
+            return policy, None
+        kernel, bias = self.value_layer
+        return policy, np.tanh(hidden @ kernel + bias)[:, 0]
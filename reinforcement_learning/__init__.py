@@ -1 +1,3 @@
 from .actor import Actor
+from .self_play import SelfPlayPool
+from .replay_store import ReplayStore
@@ -1,39 +1,148 @@
 '''
 This module contains the reinforcement learning algorithm
 '''
-import random
+import numpy as np
+from typing import TYPE_CHECKING
 from config import *
 from game.hex.hex import Hex
 from mcts import MCTS
 from mcts.node import Node
-from neural_network.anet import ANet
+from neural_network.checkpoints import CheckpointRegistry
+from .augmentation import augment
+from .replay_store import ReplayStore
+from .self_play import SelfPlayPool
+
+if TYPE_CHECKING:
+    from neural_network.anet import ANet
 
 
 class ReplayBuffer:
     '''
     Replay buffer for storing past experiences that the Actor can then use for
+    training. The cases are stored in a circular buffer of preallocated float32
+    arrays, so adding a case is O(1) and a minibatch is gathered with one index
+    operation per array.
+
+    With deduplicate, a position already in the buffer is not stored again:
+    its visit count distribution and outcome are averaged into the stored case.
+
+    Parameters
+    ----------
+    buffer_size : int
+        The maximum number of cases in the buffer
+    state_size : int
+        The size of a state representation
+    action_size : int
+        The size of a visit count distribution
+    deduplicate : bool
+        Whether identical positions are merged into one case
     '''
 
-    def __init__(self, buffer_size):
-        self.buffer = []
+    def __init__(self, buffer_size: int, state_size: int = INPUT_SHAPE, action_size: int = OUTPUT_SHAPE, deduplicate: bool = False):
         self.buffer_size = buffer_size
+        self.states = np.zeros((buffer_size, state_size), dtype=np.float32)
+        self.distributions = np.zeros((buffer_size, action_size), dtype=np.float32)
+        self.outcomes = np.zeros(buffer_size, dtype=np.float32)
+        self.position = 0
+        self.size = 0
+        self.deduplicate = deduplicate
+        # The slot of every stored position, keyed by the bytes of its state
+        self.slots = {}
+        self.keys = [None] * buffer_size
+        self.counts = np.zeros(buffer_size, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.size
 
     def add_case(self, case: tuple):
         '''
-        Add a case to the buffer
+        Add a case to the buffer, overwriting the oldest case when the buffer is full
 
         Parameters
         ----------
         case : tuple
-            A case to be added to the buffer
+            A case to be added to the buffer: the state representation, the visit
+            count distribution and optionally the outcome of the game
+        '''
+        if self.deduplicate:
+            self.add_cases(np.array([case[0]]), np.array([case[1]]),
+                           np.array([case[2] if len(case) > 2 else 0]))
+            return
+        self.states[self.position] = case[0]
+        self.distributions[self.position] = case[1]
+        self.outcomes[self.position] = case[2] if len(case) > 2 else 0
+        self.position = (self.position + 1) % self.buffer_size
+        self.size = min(self.size + 1, self.buffer_size)
+
+    def add_cases(self, states: np.ndarray, distributions: np.ndarray, outcomes: np.ndarray):
         '''
-        if len(self.buffer) >= self.buffer_size:
-            self.buffer.pop(0)
-        self.buffer.append(case)
+        Add several cases to the buffer at once
 
-    def sample_minibatch(self, batch_size: int):
+        Parameters
+        ----------
+        states : np.ndarray
+            The state representations
+        distributions : np.ndarray
+            The visit count distributions
+        outcomes : np.ndarray
+            The outcomes of the games
+        '''
+        if self.deduplicate:
+            self.merge_cases(states, distributions, outcomes)
+            return
+        n_cases = len(states)
+        if n_cases > self.buffer_size:
+            states = states[-self.buffer_size:]
+            distributions = distributions[-self.buffer_size:]
+            outcomes = outcomes[-self.buffer_size:]
+            n_cases = self.buffer_size
+        indices = (self.position + np.arange(n_cases)) % self.buffer_size
+        self.states[indices] = states
+        self.distributions[indices] = distributions
+        self.outcomes[indices] = outcomes
+        self.position = (self.position + n_cases) % self.buffer_size
+        self.size = min(self.size + n_cases, self.buffer_size)
+
+    def merge_cases(self, states: np.ndarray, distributions: np.ndarray, outcomes: np.ndarray):
         '''
-        Sample a minibatch from the buffer
+        Add cases to the buffer, merging them into the stored case of an
+        identical position instead of storing it twice
+
+        Parameters
+        ----------
+        states : np.ndarray
+            The state representations
+        distributions : np.ndarray
+            The visit count distributions
+        outcomes : np.ndarray
+            The outcomes of the games
+        '''
+        states = np.asarray(states, dtype=np.float32)
+        for state, distribution, outcome in zip(states, distributions, outcomes):
+            key = state.tobytes()
+            slot = self.slots.get(key)
+            if slot is not None:
+                count = self.counts[slot]
+                self.distributions[slot] = (self.distributions[slot] * count + distribution) / (count + 1)
+                self.outcomes[slot] = (self.outcomes[slot] * count + outcome) / (count + 1)
+                self.counts[slot] = count + 1
+                continue
+
+            slot = self.position
+            if self.keys[slot] is not None:
+                del self.slots[self.keys[slot]]
+            self.keys[slot] = key
+            self.slots[key] = slot
+            self.counts[slot] = 1
+            self.states[slot] = state
+            self.distributions[slot] = distribution
+            self.outcomes[slot] = outcome
+            self.position = (self.position + 1) % self.buffer_size
+            self.size = min(self.size + 1, self.buffer_size)
+
+    def sample_minibatch(self, batch_size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Sample a minibatch from the buffer, without replacement
 
         Parameters
         ----------
@@ -42,35 +151,49 @@ class ReplayBuffer:
 
         Returns
         -------
-        list
-            A minibatch of cases
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            The state representations, visit count distributions and outcomes of the cases
         '''
-        return random.sample(self.buffer, batch_size)
+        indices = np.random.choice(self.size, size=batch_size, replace=False)
+        return self.states[indices], self.distributions[indices], self.outcomes[indices]
 
 
 class Actor:
     '''
     Actor class
+
+    With a ReplayStore, or REPLAY_STORE_PATH set, every case is also appended to
+    the store on disk. Training then samples the latest REPLAY_BUFFER_SIZE cases
+    straight from the store, and an interrupted run continues after the last
+    stored game. Only the training process opens the store: actors of self-play
+    workers are built with replay_store=False.
     '''
 
     def __init__(
             self,
-            anet: ANet = None,
+            anet: 'ANet' = None,
             replay_buffer: ReplayBuffer = None,
             save_interval=None,
             number_actual_games=None,
             simulations=None,
             identifier: str = None,
-            time_limit: int = None
+            time_limit: int = None,
+            replay_store: ReplayStore | bool = None,
+            mcts_workers: int = None,
 
     ):
         self.anet = anet or None
-        self.replay_buffer = replay_buffer or ReplayBuffer(REPLAY_BUFFER_SIZE)
+        self.replay_buffer = replay_buffer if replay_buffer is not None else ReplayBuffer(
+            REPLAY_BUFFER_SIZE, deduplicate=DEDUPLICATE_POSITIONS)
         self.save_interval = save_interval or SAVE_INTERVAL
         self.number_actual_games = number_actual_games or NUMBER_ACTUAL_GAMES
         self.simulations = simulations or SIMULATIONS
         self.identifier = identifier or IDENTIFIER
         self.time_limit = time_limit or TIME_LIMIT
+        self.mcts_workers = mcts_workers or MCTS_WORKERS
+        if replay_store is None and REPLAY_STORE_PATH:
+            replay_store = ReplayStore(REPLAY_STORE_PATH)
+        self.replay_store = None if replay_store is False else replay_store
 
     def episilon(self, actual_game: int) -> float:
         '''
@@ -88,61 +211,248 @@ class Actor:
         '''
         return EPSILON_DECAY ** (actual_game+1)
 
-    def run(self, use_neural_network: bool = False):
+    def add_game_cases(self, game_cases: list[tuple], winner: int, game_id: int = 0):
         '''
-        Run the Actor
+        Add the cases of a finished game to the replay buffer, together with the
+        outcome of the game used as target for the value head. With
+        AUGMENT_SYMMETRIES, the symmetric variants of every case are added too.
+
+        Parameters
+        ----------
+        game_cases : list[tuple]
+            The (state representation, distribution) pairs of the game
+        winner : int
+            The winner of the game, 1 for the maximizer and -1 for the minimizer
+        game_id : int
+            The id of the game in the replay store
         '''
-        for actual_game in range(self.number_actual_games + 1):
-            game = Hex(BOARD_SIZE)
-            root_node = Node(game)
-            if use_neural_network:
-                
-                mcts = MCTS(root_node, self.simulations,
-                            self.time_limit, self.anet)
-                while not game.is_terminal():
-                    best_child, distribution = mcts(self.episilon(actual_game))
-                    state_representation = mcts.root_node.state.extract_representation()
-                    self.replay_buffer.add_case(
-                        (state_representation, distribution))
-                    action = best_child.state.get_previous_action()
-                    print(f'\nPlayer {game.player}: {action}')
-                    mcts.root_node.state.produce_successor_state(action)
-                    mcts.root_node = Node(mcts.root_node.state)
+        if not game_cases:
+            return
+        states, distributions = zip(*game_cases)
+        states, distributions = np.array(states), np.array(distributions)
+        outcomes = np.full(len(game_cases), winner)
+        if AUGMENT_SYMMETRIES:
+            states, distributions, outcomes = augment(
+                states, distributions, outcomes, BOARD_SIZE)
+        self.replay_buffer.add_cases(states, distributions, outcomes)
+        if self.replay_store is not None:
+            self.replay_store.append(states, distributions, outcomes,
+                                     game_id, game_id // self.save_interval)
 
-                    game.draw()
-                print('Winner', game.get_winner())
+    def play_game(self, use_neural_network: bool, epsilon: float = None, verbose: bool = True) -> tuple[list[tuple], int]:
+        '''
+        Play one game of self-play with MCTS
+
+        Parameters
+        ----------
+        use_neural_network : bool
+            Whether the MCTS uses the neural network
+        epsilon : float
+            The probability of a random move in the rollouts of the neural network
+        verbose : bool
+            Whether to print the moves and draw the board
 
-            else:
-                mcts = MCTS(root_node, 2500, self.time_limit)
+        Returns
+        -------
+        list[tuple]
+            The (state representation, distribution) pairs of the game
+        int
+            The winner of the game
+        '''
+        game = Hex(BOARD_SIZE)
+        root_node = Node(game)
+        game_cases = []
+        if use_neural_network:
+            mcts = MCTS(root_node, self.simulations,
+                        self.time_limit, self.anet, workers=self.mcts_workers)
+        else:
+            mcts = MCTS(root_node, 2500, self.time_limit, workers=self.mcts_workers)
 
-                while not game.is_terminal():
-                    best_child, distribution = mcts()
-                    state_representation = mcts.root_node.state.extract_representation()
-                    self.replay_buffer.add_case(
-                        (state_representation, distribution))
-                    action = best_child.state.get_previous_action()
-                    print(f'\nPlayer {game.player}: {action}')
-                    mcts.root_node.state.produce_successor_state(action)
-                    mcts.root_node = Node(mcts.root_node.state)
+        try:
+            while not game.is_terminal():
+                best_child, distribution = mcts(epsilon)
+                state_representation = mcts.root_node.state.extract_representation()
+                game_cases.append((state_representation, distribution))
+                action = best_child.state.get_previous_action()
+                game.produce_successor_state(action)
+                mcts.update_root(best_child)
 
+                if verbose:
+                    print(f'\nPlayer {1 - game.player}: {action}')
                     game.draw()
-                print('Winner', game.get_winner())
-
-                self.anet = ANet(
-                    input_shape=INPUT_SHAPE,
-                    output_shape=OUTPUT_SHAPE,
-                    layers=LAYERS,
-                    activation=ACTIVATION,
-                    optimizer=OPTIMIZER,
-                    learning_rate=LEARNING_RATE,
-                )
-                use_neural_network = True
+        finally:
+            mcts.close()
+        if verbose:
+            print('Winner', game.get_winner())
+        return game_cases, game.get_winner()
 
-            batch_size = min(REPLAY_BATCH_SIZE, len(
-                self.replay_buffer.buffer))
+    def build_anet(self) -> 'ANet':
+        '''
+        Build a new neural network from the configuration
+
+        Returns
+        -------
+        ANet
+            The neural network
+        '''
+        # Imported here, so self-play without the neural network does not load TensorFlow
+        from neural_network.anet import ANet
+
+        return ANet(
+            input_shape=INPUT_SHAPE,
+            output_shape=OUTPUT_SHAPE,
+            layers=LAYERS,
+            activation=ACTIVATION,
+            optimizer=OPTIMIZER,
+            learning_rate=LEARNING_RATE,
+            value_head=VALUE_HEAD,
+        )
+
+    def train_step(self, actual_game: int):
+        '''
+        Train the neural network on a minibatch from the replay buffer, and save
+        it every save_interval games
+
+        Parameters
+        ----------
+        actual_game : int
+            The actual game
+        '''
+        if self.replay_store is not None:
+            batch_size = min(REPLAY_BATCH_SIZE, len(self.replay_store), REPLAY_BUFFER_SIZE)
+            minibatch = self.replay_store.sample_minibatch(batch_size, REPLAY_BUFFER_SIZE)
+        else:
+            batch_size = min(REPLAY_BATCH_SIZE, len(self.replay_buffer))
             minibatch = self.replay_buffer.sample_minibatch(batch_size)
-            self.anet.train(minibatch)
-            print(f'Game {actual_game} finished.')
+        self.anet.train(minibatch)
+        print(f'Game {actual_game} finished.')
 
-            if actual_game % self.save_interval == 0:
-                self.anet.save(self.identifier, int(actual_game/SAVE_INTERVAL))
+        if actual_game % self.save_interval == 0:
+            self.anet.save(self.identifier, int(actual_game/SAVE_INTERVAL))
+
+    def run(self, use_neural_network: bool = False, workers: int = None):
+        '''
+        Run the Actor
+
+        Parameters
+        ----------
+        use_neural_network : bool
+            Whether the first game already uses the neural network
+        workers : int
+            The number of self-play processes. With more than one, the games are
+            played by a SelfPlayPool while this process trains
+        '''
+        workers = workers or SELF_PLAY_WORKERS
+        if workers > 1:
+            self.run_parallel(use_neural_network, workers)
+            return
+
+        first_game = self.first_game()
+        if first_game > 0 and self.anet is None:
+            self.anet = self.resume_anet(first_game)
+            use_neural_network = True
+
+        for actual_game in range(first_game, self.number_actual_games + 1):
+            epsilon = self.episilon(actual_game) if use_neural_network else None
+            game_cases, winner = self.play_game(use_neural_network, epsilon)
+            self.add_game_cases(game_cases, winner, actual_game)
+
+            if not use_neural_network:
+                self.anet = self.build_anet()
+                use_neural_network = True
+
+            self.train_step(actual_game)
+
+    def run_parallel(self, use_neural_network: bool, workers: int):
+        '''
+        Run the Actor with a pool of self-play processes. The workers play with a
+        snapshot of the weights of the neural network, which is refreshed every
+        WEIGHT_REFRESH_INTERVAL games, while this process trains on the streamed cases
+
+        Parameters
+        ----------
+        use_neural_network : bool
+            Whether the first games already use the neural network
+        workers : int
+            The number of self-play processes
+        '''
+        first_game = self.first_game()
+        if first_game > 0 and self.anet is None:
+            self.anet = self.resume_anet(first_game)
+            use_neural_network = True
+        if use_neural_network and self.anet is None:
+            self.anet = self.build_anet()
+        pool = SelfPlayPool(workers, self.simulations,
+                            self.time_limit, shared_inference=SHARED_INFERENCE)
+        pool.start(self.snapshot_weights(use_neural_network), self.episilon(0))
+        try:
+            for actual_game in range(first_game, self.number_actual_games + 1):
+                game_cases, winner = pool.next_game()
+                self.add_game_cases(game_cases, winner, actual_game)
+
+                if self.anet is None:
+                    self.anet = self.build_anet()
+
+                self.train_step(actual_game)
+                if actual_game % WEIGHT_REFRESH_INTERVAL == 0:
+                    pool.update_weights(self.snapshot_weights(True), self.episilon(actual_game))
+        finally:
+            pool.close()
+
+    def first_game(self) -> int:
+        '''
+        Return the first game of the run, which follows the last game in the
+        replay store when an interrupted run is resumed
+
+        Returns
+        -------
+        int
+            The first game
+        '''
+        if self.replay_store is None:
+            return 0
+        return self.replay_store.next_game_id()
+
+    def resume_anet(self, first_game: int) -> 'ANet':
+        '''
+        Return the neural network of the last checkpoint saved before the first
+        game of a resumed run, to continue its training
+
+        Parameters
+        ----------
+        first_game : int
+            The first game of the resumed run
+
+        Returns
+        -------
+        ANet
+            The neural network
+        '''
+        registry = CheckpointRegistry(self.identifier, BOARD_SIZE)
+        checkpoint = (first_game - 1) // SAVE_INTERVAL
+        while checkpoint >= 0 and checkpoint not in registry:
+            checkpoint -= 1
+        if checkpoint < 0:
+            raise FileNotFoundError(
+                f'Cannot resume after game {first_game - 1} without a checkpoint in '
+                f'{registry.directory}, run with --load_models or a new replay store')
+        print(f'Resuming from game {first_game} with checkpoint {checkpoint}')
+        return registry.load_anet(checkpoint)
+
+    def snapshot_weights(self, use_neural_network: bool) -> list:
+        '''
+        Return a copy of the weights of the neural network for the self-play workers
+
+        Parameters
+        ----------
+        use_neural_network : bool
+            Whether the workers should use the neural network
+
+        Returns
+        -------
+        list
+            The weights as NumPy arrays, or None to play without the neural network
+        '''
+        if not use_neural_network or self.anet is None:
+            return None
+        return self.anet.model.get_weights()
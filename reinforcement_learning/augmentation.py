@@ -0,0 +1,66 @@
+'''
+This module contains the symmetries of Hex used to augment the training data
+'''
+import numpy as np
+
+
+def symmetry_permutations(board_size: int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Return the permutations of the flat board indices under the symmetries of
+    Hex: the 180 degree rotation, and the transpose, which swaps the edges of
+    the players and is therefore combined with a colour swap
+
+    Parameters
+    ----------
+    board_size : int
+        The size of the board
+
+    Returns
+    -------
+    np.ndarray
+        The permutation of the 180 degree rotation
+    np.ndarray
+        The permutation of the transpose
+    '''
+    indices = np.arange(board_size * board_size).reshape(board_size, board_size)
+    return indices[::-1, ::-1].ravel(), indices.T.ravel()
+
+
+def augment(
+    states: np.ndarray,
+    distributions: np.ndarray,
+    outcomes: np.ndarray,
+    board_size: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Return the cases together with their symmetric variants: the identity, the
+    180 degree rotation, the colour-swapped transpose and their composition.
+    The colour swap negates the stones, the player to move and the outcome.
+
+    Parameters
+    ----------
+    states : np.ndarray
+        The state representations, the flat board followed by the player to move
+    distributions : np.ndarray
+        The visit count distributions
+    outcomes : np.ndarray
+        The outcomes of the games, 1 when the maximizer won
+    board_size : int
+        The size of the board
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        The four variants of every case, in blocks of len(states) cases
+    '''
+    rotation, transpose = symmetry_permutations(board_size)
+    n_cells = board_size * board_size
+    boards, players = states[:, :n_cells], states[:, n_cells:]
+    variants = []
+    for permutation, sign in ((None, 1), (rotation, 1), (transpose, -1), (transpose[rotation], -1)):
+        if permutation is None:
+            variants.append((states, distributions, outcomes))
+            continue
+        variants.append((np.hstack([sign * boards[:, permutation], sign * players]),
+                         distributions[:, permutation], sign * outcomes))
+    return tuple(np.concatenate(column) for column in zip(*variants))
@@ -0,0 +1,197 @@
+'''
+This module contains a persistent, append-only store of self-play cases
+'''
+import json
+import os
+import numpy as np
+from config import INPUT_SHAPE, OUTPUT_SHAPE
+
+
+class ReplayStore:
+    '''
+    An append-only store of self-play cases on disk. Every column is a raw
+    binary file that is only ever appended to, and reads go through np.memmap,
+    so windows of cases are read without copying and the dataset never has to
+    fit in memory. The number of cases is derived from the file sizes, so a
+    store left by an interrupted run can be opened and appended to again.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the store
+    state_size : int
+        The size of a state representation
+    action_size : int
+        The size of a visit count distribution
+    '''
+
+    def __init__(self, path: str, state_size: int = INPUT_SHAPE, action_size: int = OUTPUT_SHAPE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        metadata_path = os.path.join(path, 'metadata.json')
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as file:
+                metadata = json.load(file)
+            if (metadata['state_size'], metadata['action_size']) != (state_size, action_size):
+                raise ValueError('The replay store was written for another board size')
+        else:
+            with open(metadata_path, 'w') as file:
+                json.dump({'state_size': state_size, 'action_size': action_size}, file)
+
+        self.columns = {
+            'states': (np.float32, (state_size,)),
+            'distributions': (np.float32, (action_size,)),
+            'outcomes': (np.float32, ()),
+            'game_ids': (np.int64, ()),
+            'generations': (np.int32, ()),
+        }
+        self.files = {name: open(self.column_path(name), 'ab')
+                      for name in self.columns}
+        self.size = self.stored_cases()
+        # A run killed mid-append leaves a partial row, which is truncated
+        for name, file in self.files.items():
+            file.truncate(self.size * self.row_bytes(name))
+        self.views = {}
+
+    def column_path(self, name: str) -> str:
+        '''
+        Return the path of the file of a column
+        '''
+        return os.path.join(self.path, f'{name}.bin')
+
+    def row_bytes(self, name: str) -> int:
+        '''
+        Return the number of bytes of one case in a column
+        '''
+        dtype, shape = self.columns[name]
+        return np.dtype(dtype).itemsize * int(np.prod(shape))
+
+    def stored_cases(self) -> int:
+        '''
+        Return the number of complete cases in every column file
+        '''
+        return min(os.path.getsize(self.column_path(name)) // self.row_bytes(name)
+                   for name in self.columns)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, states: np.ndarray, distributions: np.ndarray, outcomes: np.ndarray, game_id: int, generation: int):
+        '''
+        Append the cases of one game to the store
+
+        Parameters
+        ----------
+        states : np.ndarray
+            The state representations
+        distributions : np.ndarray
+            The visit count distributions
+        outcomes : np.ndarray
+            The outcomes of the game
+        game_id : int
+            The id of the game
+        generation : int
+            The generation of the model that played the game
+        '''
+        n_cases = len(states)
+        data = {
+            'states': states,
+            'distributions': distributions,
+            'outcomes': outcomes,
+            'game_ids': np.full(n_cases, game_id),
+            'generations': np.full(n_cases, generation),
+        }
+        for name, (dtype, _) in self.columns.items():
+            self.files[name].write(np.ascontiguousarray(data[name], dtype=dtype).tobytes())
+        self.flush()
+        self.size += n_cases
+        self.views = {}
+
+    def flush(self):
+        '''
+        Flush the appended cases to disk
+        '''
+        for file in self.files.values():
+            file.flush()
+
+    def column(self, name: str) -> np.ndarray:
+        '''
+        Return a read-only memory map of a column. The maps are recreated after
+        an append, since a memory map does not grow with its file.
+
+        Parameters
+        ----------
+        name : str
+            The name of the column
+
+        Returns
+        -------
+        np.ndarray
+            The memory-mapped column
+        '''
+        if name not in self.views:
+            dtype, shape = self.columns[name]
+            if self.size == 0:
+                self.views[name] = np.zeros((0, *shape), dtype=dtype)
+            else:
+                self.views[name] = np.memmap(self.column_path(name), dtype=dtype,
+                                             mode='r', shape=(self.size, *shape))
+        return self.views[name]
+
+    def window(self, start: int = 0, stop: int = None) -> tuple[np.ndarray, ...]:
+        '''
+        Return a window of cases as views into the memory maps, without copying
+
+        Parameters
+        ----------
+        start : int
+            The first case of the window
+        stop : int
+            The end of the window, by default the end of the store
+
+        Returns
+        -------
+        tuple[np.ndarray, ...]
+            The state representations, visit count distributions, outcomes, game
+            ids and model generations of the cases
+        '''
+        return tuple(self.column(name)[start:stop] for name in self.columns)
+
+    def sample_minibatch(self, batch_size: int, window_size: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Sample a minibatch, without replacement, from the latest cases. Only the
+        sampled rows are read from disk.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the minibatch
+        window_size : int
+            The number of latest cases sampled from, by default all the cases
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            The state representations, visit count distributions and outcomes of the cases
+        '''
+        start = 0 if window_size is None else max(0, self.size - window_size)
+        indices = np.sort(np.random.choice(self.size - start, size=batch_size, replace=False)) + start
+        return (self.column('states')[indices], self.column('distributions')[indices],
+                self.column('outcomes')[indices])
+
+    def next_game_id(self) -> int:
+        '''
+        Return the id following the last stored game, so an interrupted run can
+        continue from it
+        '''
+        if self.size == 0:
+            return 0
+        return int(self.column('game_ids')[-1]) + 1
+
+    def close(self):
+        '''
+        Close the column files
+        '''
+        for file in self.files.values():
+            file.close()
+        self.views = {}
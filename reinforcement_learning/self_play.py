@@ -0,0 +1,240 @@
+'''
+This module contains the pool of processes playing self-play games in parallel
+'''
+import multiprocessing as mp
+import queue
+import traceback
+from neural_network.inference_server import InferenceClient, InferenceServer
+
+
+def self_play_worker(
+        worker: int,
+        weights_queue: mp.Queue,
+        case_queue: mp.Queue,
+        simulations: int,
+        time_limit: int,
+        inference_client: InferenceClient = None,
+):
+    '''
+    Play self-play games until a stop message is received. Before each game the
+    worker takes the latest (weights, epsilon) message from its weights queue,
+    and streams the cases of every finished game to the case queue. An exception
+    is sent to the case queue before the worker stops.
+
+    Parameters
+    ----------
+    worker : int
+        The number of the worker
+    weights_queue : mp.Queue
+        The queue of (weights, epsilon) messages from the trainer. The weights are
+        None to play without the neural network, and the message is None to stop.
+    case_queue : mp.Queue
+        The queue receiving a (worker, (cases, winner), None) message for every
+        finished game, or a (worker, None, traceback) message on an exception
+    simulations : int
+        The number of simulations per move
+    time_limit : int
+        The time limit per move
+    inference_client : InferenceClient
+        A client of a shared inference server. The worker then evaluates positions
+        through the server instead of its own neural network, and the weights in
+        the messages only tell whether the network is available.
+    '''
+    try:
+        play_self_play_games(worker, weights_queue, case_queue,
+                             simulations, time_limit, inference_client)
+    except Exception:
+        case_queue.put((worker, None, traceback.format_exc()))
+
+
+def play_self_play_games(
+        worker: int,
+        weights_queue: mp.Queue,
+        case_queue: mp.Queue,
+        simulations: int,
+        time_limit: int,
+        inference_client: InferenceClient = None,
+):
+    '''
+    The loop of a self-play worker, with the parameters of self_play_worker
+    '''
+    # Imported here, so only the worker processes build a neural network
+    from .actor import Actor
+
+    # The replay store is only opened by the training process, which appends to it.
+    # The games are already played in parallel, so each search runs in this process.
+    actor = Actor(simulations=simulations, time_limit=time_limit,
+                  replay_store=False, mcts_workers=1)
+    message = weights_queue.get()
+    while True:
+        try:
+            while True:
+                message = weights_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if message is None:
+            return
+
+        weights, epsilon = message
+        if weights is not None and inference_client is not None:
+            actor.anet = inference_client
+        elif weights is not None:
+            if actor.anet is None:
+                actor.anet = actor.build_anet()
+            actor.anet.set_weights(weights)
+        use_neural_network = actor.anet is not None
+        case_queue.put((worker, actor.play_game(
+            use_neural_network, epsilon if use_neural_network else None, verbose=False), None))
+
+
+class SelfPlayPool:
+    '''
+    A pool of processes playing self-play games with a read-only snapshot of
+    the weights of the neural network
+
+    Parameters
+    ----------
+    workers : int
+        The number of processes
+    simulations : int
+        The number of simulations per move
+    time_limit : int
+        The time limit per move
+    shared_inference : bool
+        Whether the workers share one InferenceServer, which batches their
+        requests, instead of each running its own neural network
+    '''
+
+    def __init__(self, workers: int, simulations: int, time_limit: int, shared_inference: bool = False):
+        self.workers = workers
+        self.simulations = simulations
+        self.time_limit = time_limit
+        # TensorFlow is not fork-safe, so the workers are started with spawn
+        self.context = mp.get_context('spawn')
+        self.case_queue = self.context.Queue()
+        self.weights_queues = []
+        self.processes = []
+        self.inference_server = InferenceServer(
+            workers, context=self.context) if shared_inference else None
+
+    def start(self, weights: list, epsilon: float):
+        '''
+        Start the worker processes
+
+        Parameters
+        ----------
+        weights : list
+            The weights of the neural network, or None to play without it
+        epsilon : float
+            The probability of a random move in the rollouts of the neural network
+        '''
+        if self.inference_server is not None:
+            self.inference_server.start(weights)
+        for worker in range(self.workers):
+            weights_queue = self.context.Queue()
+            weights_queue.put(self.worker_message(weights, epsilon))
+            inference_client = None
+            if self.inference_server is not None:
+                inference_client = self.inference_server.clients[worker]
+            process = self.context.Process(
+                target=self_play_worker,
+                args=(worker, weights_queue, self.case_queue, self.simulations,
+                      self.time_limit, inference_client),
+                daemon=True)
+            process.start()
+            self.weights_queues.append(weights_queue)
+            self.processes.append(process)
+
+    def update_weights(self, weights: list, epsilon: float):
+        '''
+        Send new weights to every worker. They are used from the next game on.
+
+        Parameters
+        ----------
+        weights : list
+            The weights of the neural network
+        epsilon : float
+            The probability of a random move in the rollouts of the neural network
+        '''
+        if self.inference_server is not None:
+            self.inference_server.update_weights(weights)
+        for weights_queue in self.weights_queues:
+            weights_queue.put(self.worker_message(weights, epsilon))
+
+    def worker_message(self, weights: list, epsilon: float) -> tuple:
+        '''
+        Return the message sent to the workers for new weights. With a shared
+        inference server the weights stay in the server, and the workers are
+        only told whether the network is available.
+
+        Parameters
+        ----------
+        weights : list
+            The weights of the neural network, or None to play without it
+        epsilon : float
+            The probability of a random move in the rollouts of the neural network
+
+        Returns
+        -------
+        tuple
+            The (weights, epsilon) message
+        '''
+        if self.inference_server is not None and weights is not None:
+            return True, epsilon
+        return weights, epsilon
+
+    def next_game(self, poll_interval: float = 1.0) -> tuple[list[tuple], int]:
+        '''
+        Wait for the next finished game of any worker. While waiting, the
+        workers are checked every poll_interval seconds, so a worker that died
+        raises an error instead of blocking the training forever.
+
+        Parameters
+        ----------
+        poll_interval : float
+            The time between the checks of the workers, in seconds
+
+        Returns
+        -------
+        list[tuple]
+            The (state representation, distribution) pairs of the game
+        int
+            The winner of the game
+        '''
+        while True:
+            try:
+                worker, game, error = self.case_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                self.check_workers()
+                continue
+            if error is not None:
+                raise RuntimeError(f'Self-play worker {worker} failed:\n{error}')
+            return game
+
+    def check_workers(self):
+        '''
+        Raise an error if a worker process, or the inference server, stopped
+        before the pool was closed
+        '''
+        for worker, process in enumerate(self.processes):
+            if process.exitcode is not None:
+                raise RuntimeError(
+                    f'Self-play worker {worker} (pid {process.pid}) exited with code {process.exitcode}')
+        if self.inference_server is not None and self.inference_server.process.exitcode is not None:
+            raise RuntimeError(
+                f'The inference server exited with code {self.inference_server.process.exitcode}')
+
+    def close(self):
+        '''
+        Stop the worker processes
+        '''
+        for weights_queue in self.weights_queues:
+            weights_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.weights_queues = []
+        self.processes = []
+        if self.inference_server is not None:
+            self.inference_server.close()
@@ -0,0 +1,98 @@
+'''
+This module contains the statistics used to rank the agents of the tournament
+'''
+import math
+from statistics import NormalDist
+import numpy as np
+
+ELO_SCALE = 400 / math.log(10)
+
+
+def bradley_terry(wins: np.ndarray, confidence: float, iterations: int = 1000, tolerance: float = 1e-9) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Fit Bradley-Terry strengths to a win matrix with the minorization-
+    maximization algorithm, and return them as Elo ratings with the half width
+    of their confidence intervals. Every pair that played gets one virtual draw,
+    so agents that won or lost every game still have a finite rating.
+
+    Parameters
+    ----------
+    wins : np.ndarray
+        wins[i, j] is the number of games agent i won against agent j
+    confidence : float
+        The confidence level of the intervals
+    iterations : int
+        The maximum number of iterations
+    tolerance : float
+        The largest change of a strength at which the fit is done
+
+    Returns
+    -------
+    np.ndarray
+        The Elo rating of every agent, with a mean of 0
+    np.ndarray
+        The half width of the confidence interval of every rating
+    '''
+    games = wins + wins.T
+    prior = 0.5 * (games > 0)
+    wins = wins + prior
+    games = games + 2 * prior
+    total_wins = wins.sum(axis=1)
+
+    strengths = np.ones(len(wins))
+    for _ in range(iterations):
+        denominators = (games / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+        updated = np.divide(total_wins, denominators,
+                            out=strengths.copy(), where=denominators > 0)
+        updated /= np.exp(np.log(updated).mean())
+        done = np.abs(updated - strengths).max() < tolerance
+        strengths = updated
+        if done:
+            break
+
+    log_strengths = np.log(strengths)
+    # Fisher information of the log strengths, singular since only differences count
+    probabilities = strengths[:, None] / (strengths[:, None] + strengths[None, :])
+    information = -games * probabilities * probabilities.T
+    np.fill_diagonal(information, 0)
+    np.fill_diagonal(information, -information.sum(axis=1))
+    covariance = np.linalg.pinv(information)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    half_widths = z * np.sqrt(np.clip(np.diag(covariance), 0, None))
+    return ELO_SCALE * (log_strengths - log_strengths.mean()), ELO_SCALE * half_widths
+
+
+def pairing_decided(wins: int, losses: int, remaining: int, confidence: float) -> bool:
+    '''
+    Check if the result of a pairing is clear, so its remaining games can be
+    skipped. It is clear when the remaining games cannot change the majority,
+    or when the Wilson score interval of the win rate excludes one half.
+    Checking the interval after every round makes the test somewhat more
+    eager than its nominal confidence.
+
+    Parameters
+    ----------
+    wins : int
+        The number of games won by the first agent
+    losses : int
+        The number of games won by the second agent
+    remaining : int
+        The number of games left in the pairing
+    confidence : float
+        The confidence level of the interval
+
+    Returns
+    -------
+    bool
+        True if the pairing can stop
+    '''
+    if abs(wins - losses) > remaining:
+        return True
+    games = wins + losses
+    if games == 0:
+        return False
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    rate = wins / games
+    centre = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    half_width = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return centre - half_width > 0.5 or centre + half_width < 0.5
@@ -1,91 +1,311 @@
-''' 
-This module contains tournament of progressive policy to determine which of 
+'''
+This module contains tournament of progressive policy to determine which of
 trained agents with different evolution is the best.
 '''
-from config import IDENTIFIER, BOARD_SIZE
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from config import BOARD_SIZE, TOPP_WORKERS, TOPP_GAMES_PER_PAIR, TOPP_TEMPERATURE, TOPP_CONFIDENCE
 from game import Hex
-from mcts import Node, MCTS
-import random
-import math
-from neural_network import ANet, load_models
-import tensorflow as tf
+from neural_network.inference_cache import CachedInference
+from .rating import bradley_terry, pairing_decided
 import numpy as np
-from copy import copy
+
+# The neural networks of a tournament worker process
+worker_networks: list[CachedInference] = None
+
+
+def init_topp_worker(models: list):
+    '''
+    Rebuild the models of the tournament in a worker process
+
+    Parameters
+    ----------
+    models : list
+        Every model as a NumpyNet, or as the (JSON architecture, weights) of a Keras model
+    '''
+    global worker_networks
+    worker_networks = []
+    for model in models:
+        if not isinstance(model, CachedInference):
+            # Imported here, so tournaments of NumPy networks do not load TensorFlow
+            import tensorflow as tf
+            from neural_network.anet import ANet
+            architecture, model_weights = model
+            model = ANet(model=tf.keras.models.model_from_json(architecture))
+            model.set_weights(model_weights)
+        worker_networks.append(model)
+
+
+def topp_worker(pairings: list[tuple[int, int]], temperature: float) -> list[int]:
+    '''
+    Play the games of some pairings in a worker process
+
+    Parameters
+    ----------
+    pairings : list[tuple[int, int]]
+        The (first model, second model) of every game
+    temperature : float
+        The temperature of the move sampling
+
+    Returns
+    -------
+    list[int]
+        The winning model of every game
+    '''
+    return play_games(worker_networks, pairings, temperature)
+
+
+def play_games(
+    networks: list[CachedInference],
+    pairings: list[tuple[int, int]],
+    temperature: float = 0,
+    board_size: int = BOARD_SIZE,
+) -> list[int]:
+    '''
+    Play the games of several pairings together. At every ply, the positions of
+    the unfinished games are grouped by the model to move, and every model
+    predicts its positions with one batched call. The first model of a pairing
+    starts the game. With a temperature of 0 the most probable legal move is
+    played, otherwise moves are sampled from the policy sharpened or flattened
+    by the temperature.
+
+    Parameters
+    ----------
+    networks : list[CachedInference]
+        The neural network of every model
+    pairings : list[tuple[int, int]]
+        The (first model, second model) of every game
+    temperature : float
+        The temperature of the move sampling
+    board_size : int
+        The size of the board
+
+    Returns
+    -------
+    list[int]
+        The winning model of every game
+    '''
+    games = [Hex(board_size) for _ in pairings]
+    live_games = list(range(len(games)))
+    while live_games:
+        positions = {}
+        for game in live_games:
+            model = pairings[game][games[game].player]
+            positions.setdefault(model, []).append(game)
+        for model, model_games in positions.items():
+            state_representations = np.stack(
+                [games[game].extract_representation() for game in model_games])
+            target_dists = networks[model].predict(state_representations)
+            if temperature > 0:
+                target_dists = np.power(target_dists, 1 / temperature)
+            for game, target_dist in zip(model_games, target_dists):
+                if temperature > 0:
+                    games[game].make_move(games[game].masked_sample(target_dist))
+                else:
+                    games[game].make_move(games[game].masked_argmax(target_dist))
+        live_games = [game for game in live_games if not games[game].is_terminal()]
+    # Player 0, the first model, is the minimizer
+    return [first if game.get_winner() == -1 else second
+            for (first, second), game in zip(pairings, games)]
 
 
 class TOPP:
     '''
-    Tournament of progressive policy to determine which of trained agents 
+    Tournament of progressive policy to determine which of trained agents
     with different evolution is the best.
 
+    Every pair of models plays up to games_per_pair games, alternating which
+    model moves first. The games are played in rounds of one game with each
+    model first, together with batched predictions, and with more than one
+    worker they are spread over a process pool. A pairing stops early once its
+    result is clear. The results are kept as a win matrix, from which
+    Bradley-Terry ratings on the Elo scale are fitted.
+
+    Parameters
+    ----------
+    models : list
+        The models of the tournament, as Keras models or inference backends like
+        ANet and NumpyNet
+    workers : int
+        The number of processes playing the games
+    games_per_pair : int
+        The maximum number of games played by each pair of models
+    temperature : float
+        The temperature of the move sampling, 0 to always play the most probable move
+    confidence : float
+        The confidence level of the early stopping and of the rating intervals
     '''
 
-    def __init__(self, models: list[tf.keras.Model]):
+    def __init__(
+        self,
+        models: list,
+        workers: int = TOPP_WORKERS,
+        games_per_pair: int = TOPP_GAMES_PER_PAIR,
+        temperature: float = TOPP_TEMPERATURE,
+        confidence: float = TOPP_CONFIDENCE,
+    ):
         self.models = models
+        self.networks = [self.network(model) for model in models]
+        self.workers = workers
+        self.games_per_pair = games_per_pair
+        self.temperature = temperature
+        self.confidence = confidence
+        # wins[i, j] is the number of games model i won against model j
+        self.wins = np.zeros((len(models), len(models)), dtype=int)
         self.results = []
 
-    def play_game(self, agent1: tf.keras.Model, agent2: tf.keras.Model):
+    @staticmethod
+    def network(model) -> CachedInference:
+        '''
+        Return the inference backend of a model. Keras models are wrapped in
+        ANet to share its inference cache across the games of a model.
+
+        Parameters
+        ----------
+        model : tf.keras.Model or CachedInference
+            The model
+
+        Returns
+        -------
+        CachedInference
+            The inference backend
+        '''
+        if isinstance(model, CachedInference):
+            return model
+        from neural_network.anet import ANet
+        return ANet(model=model)
+
+    def play_game(self, agent1, agent2):
         '''
         Play a game between two agents
 
         Parameters
         ----------
-        agent1 : ANet
+        agent1 : tf.keras.Model or CachedInference
             The first agent
-        agent2 : ANet
+        agent2 : tf.keras.Model or CachedInference
             The second agent
+        '''
+        pairing = (self.models.index(agent1), self.models.index(agent2))
+        self.add_results([pairing], play_games(self.networks, [pairing], self.temperature))
+
+    def tournament(self):
+        '''
+        Play the tournament
+        '''
+        pairs = [(first, second) for first in range(len(self.models))
+                 for second in range(first + 1, len(self.models))]
+        executor = self.get_executor() if self.workers > 1 else None
+        try:
+            played = 0
+            while pairs and played < self.games_per_pair:
+                pairings = [pairing for first, second in pairs
+                            for pairing in ((first, second), (second, first))]
+                if self.games_per_pair - played == 1:
+                    # An odd last game is started by the first model of the pair
+                    pairings = pairings[::2]
+                if executor is not None:
+                    winners = self.play_parallel(executor, pairings)
+                else:
+                    winners = play_games(self.networks, pairings, self.temperature)
+                self.add_results(pairings, winners)
+                played += 2
+                remaining = max(self.games_per_pair - played, 0)
+                pairs = [(first, second) for first, second in pairs
+                         if not pairing_decided(self.wins[first, second], self.wins[second, first],
+                                                remaining, self.confidence)]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        '''
+        Start the process pool of the tournament. Each process rebuilds the Keras
+        models from their architecture and weights, and gets a copy of the other
+        inference backends.
 
         Returns
         -------
-        int
-            The winner of the game
-        '''
-        players = [agent1, agent2]
-        player = players[0]
-
-        game = Hex(BOARD_SIZE)
-        node = Node(game)
-        while not game.is_terminal():
-            state_repesentation = node.state.extract_representation(False)
-            target_dist = player.predict(state_repesentation, verbose=0)
-            flatten_state = node.state.extract_flatten_state()
-            legal_action = [1 if flatten_state[i] ==
-                            0 else 0 for i in range(len(flatten_state))]
-            target_dist = np.array(target_dist) * np.array(legal_action)
-
-            i = np.argmax(target_dist)
-            best_action = i // BOARD_SIZE, i % BOARD_SIZE
-            node.state.produce_successor_state(best_action)
-
-            self.change_agent(players, player)
-        self.change_agent(players, player)
-        self.results.append(
-            f'Model {self.models.index(agent1)} vs Model {self.models.index(agent2)}:  Winner: Model {self.models.index(player)} wins')
+        ProcessPoolExecutor
+            The process pool
+        '''
+        models = [(network.model.to_json(), network.model.get_weights())
+                  if hasattr(network, 'model') else network for network in self.networks]
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context('spawn'),
+            initializer=init_topp_worker,
+            initargs=(models,))
 
-    def tournament(self):
+    def play_parallel(self, executor: ProcessPoolExecutor, pairings: list[tuple[int, int]]) -> list[int]:
         '''
-        Play the tournament
+        Play the games of the pairings in a process pool, each process playing
+        an equal share of the games together
+
+        Parameters
+        ----------
+        executor : ProcessPoolExecutor
+            The process pool
+        pairings : list[tuple[int, int]]
+            The (first model, second model) of every game
+
+        Returns
+        -------
+        list[int]
+            The winning model of every game
         '''
-        for first_model in self.models:
-            models = copy(self.models)
-            models.remove(first_model)
-            for second_model in models:
-                self.play_game(first_model, second_model)
+        chunks = [pairings[worker::self.workers] for worker in range(self.workers)]
+        chunk_winners = list(executor.map(
+            topp_worker, chunks, [self.temperature] * self.workers))
 
-    def change_agent(self, agents: list[ANet], agent: ANet) -> 'ANet':
+        winners = [None] * len(pairings)
+        for worker, worker_winners in enumerate(chunk_winners):
+            winners[worker::self.workers] = worker_winners
+        return winners
+
+    def add_results(self, pairings: list[tuple[int, int]], winners: list[int]):
         '''
-        Change the agent for the next game
+        Record the results of played games in the win matrix and in the list of
+        (first model, second model, winner) results
 
         Parameters
         ----------
-        agent : ANet
-            The agent to change
+        pairings : list[tuple[int, int]]
+            The (first model, second model) of every game
+        winners : list[int]
+            The winning model of every game
+        '''
+        for (first, second), winner in zip(pairings, winners):
+            loser = second if winner == first else first
+            self.wins[winner, loser] += 1
+            self.results.append((first, second, winner))
+
+    def ratings(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the Elo ratings of the models fitted to the win matrix
+
+        Returns
+        -------
+        np.ndarray
+            The rating of every model, with a mean of 0
+        np.ndarray
+            The half width of the confidence interval of every rating
+        '''
+        return bradley_terry(self.wins, self.confidence)
+
+    def summary(self) -> str:
+        '''
+        Return the win matrix and the ratings as a printable table
 
         Returns
         -------
-        ANet
-            The new agent
+        str
+            The table, with one row per model
         '''
-        agents = agents.copy()
-        agents.remove(agent)
-        return agents[0]
+        ratings, half_widths = self.ratings()
+        lines = ['Model  ' + ' '.join(f'{model:>4}' for model in range(len(self.models)))
+                 + '    Elo']
+        for model, (row, rating, half_width) in enumerate(zip(self.wins, ratings, half_widths)):
+            lines.append(f'{model:>5}  ' + ' '.join(f'{wins:>4}' for wins in row)
+                         + f'  {rating:>5.0f} ± {half_width:.0f}')
+        return '\n'.join(lines)